@@ -0,0 +1,301 @@
+'''
+Run PDS and QC jobs without the Streamlit app, for example to process a
+night's worth of studies on the analysis server:
+
+    python batch.py jobs/ --workers 8
+
+Each job is a json file. Relative paths are taken from the job file's folder.
+
+PDS job:
+    {
+        "pipeline": "PDS",
+        "study_name": "Stability 12",
+        "filepath": "study12",            # data.csv, strip_images/ and the
+                                          # blank TMF-901B; outputs go here
+        "assay": "Rapid Recency",         # or "Oral Fluid"
+        "panel": "9169",                  # supported panel or list of specimens
+        "rep_qty": 3,
+        "reps_in_title": true,
+        "conditions": ["4C", "37C"],      # list, "search" or [] for none
+        "other_data": true,
+        "lots": ["rep 1", "rep 2", "rep 3"],
+        "stats": ["Mean", "SD", "%CV"],   # also "Median", "MAD",
+                                          # "Shapiro p", "Outliers", "Shifts"
+        "shift_k": 3,                     # optional, flag positions more than
+                                          # k MADs from the run median
+        "ver_limit": 330,                 # optional, defaults for the assay
+        "ltr_limit": 530,
+        "outputs": ["csv", "txt", "tmf901b"],  # also "xlsx", "parquet"
+        "incremental": false,             # only process tests added since
+                                          # the last run of this job
+        "workers": 1,                     # optional, split the replicate
+                                          # stats of a large study with many
+                                          # conditions over this many processes
+        "tmf901b_pages": 50,              # optional, split the TMF-901B into
+                                          # documents of this many pages, or
+        "tmf901b_rows": 500,              # of this many rows, zipped together
+        "profile": false                  # optional, add a cProfile and
+                                          # tracemalloc capture to the run
+                                          # report written with the csv
+    }
+
+QC job:
+    {
+        "pipeline": "QC",
+        "data": "TestResults.csv",
+        "template": "TMF-901B blank.docx",
+        "filepath": "strip_images",
+        "output": "QC lot 1 TMF-901B.docx"
+    }
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from datetime import date
+import json
+import os
+import sys
+
+import export_cache
+import incremental
+import metrics
+import ingest
+import panels
+import pds
+import shifts
+import writers
+
+
+def load_job(path: str) -> dict:
+    '''
+    Read a job file and resolve its paths relative to the job file.
+    '''
+    with open(path) as f:
+        job = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(path))
+    for key in ['filepath', 'data', 'template', 'output']:
+        if key in job:
+            job[key] = os.path.join(root, job[key])
+
+    return job
+
+
+def job_config(job: dict, read_in) -> pds.PdsConfig:
+    '''
+    PdsConfig for a PDS job. read_in is only used to search for conditions.
+    '''
+    rep_qty = int(job['rep_qty'])
+
+    panel = job['panel']
+    if isinstance(panel, str):
+        panel = panels.get_panel(panel).specimens
+
+    conditions = job.get('conditions', [])
+    if conditions == 'search':
+        conditions = pds.get_conditions(read_in)
+
+    assay = job.get('assay', 'Rapid Recency')
+    limits = shifts.ASSAY_LIMITS[assay]
+    shift_limits = replace(
+        limits, ver=job.get('ver_limit', limits.ver),
+        ltr=job.get('ltr_limit', limits.ltr), k=job.get('shift_k')
+        )
+
+    return pds.PdsConfig(
+        study_name=job['study_name'],
+        panel=panel,
+        rep_qty=rep_qty,
+        test_lines=2 if assay == 'Rapid Recency' else 1,
+        reps_in_title=job.get('reps_in_title', True),
+        conditions=conditions,
+        other_data=job.get('other_data', True),
+        lots=job.get('lots', ['rep {}'.format(i + 1) for i in range(rep_qty)]),
+        rep_stats=job.get('stats', []),
+        filepath=os.path.join(job['filepath'], ''),
+        shift_limits=shift_limits
+        )
+
+
+def write_outputs(config: pds.PdsConfig, result: pds.PdsResult, outputs: list) -> list:
+    '''
+    Write the formatted data table in every format listed in outputs.
+    Returns the files written.
+    '''
+    written = []
+    if 'csv' in outputs:
+        writers.write_rows(config.csv_path, result.headers, result.rows, 'csv')
+        written.append(config.csv_path)
+    if 'txt' in outputs:
+        output = config.filepath + '{} Formatted data.txt'.format(config.study_name)
+        writers.write_rows(output, result.headers, result.rows, 'tsv')
+        written.append(output)
+    for fmt in ['xlsx', 'parquet']:
+        if fmt in outputs:
+            output = config.filepath + '{} Formatted data{}'.format(
+                config.study_name, writers.EXTENSIONS[fmt])
+            writers.write_table(output, writers.prism_table(result.stats_table, config), fmt)
+            written.append(output)
+    return written
+
+
+def run_pds_job(job: dict) -> tuple:
+    '''
+    Format, run stats on and export a PDS study the same way the app does.
+    Returns the files written and the warnings.
+    '''
+    filepath = os.path.join(job['filepath'], '')
+    outputs = job.get('outputs', ['csv'])
+
+    data_path = job.get('data', filepath + 'data.csv')
+    if job.get('incremental', False):
+        return run_incremental_job(job, data_path, outputs)
+
+    run_metrics = metrics.RunMetrics(profile=job.get('profile', False))
+    with run_metrics.capture():
+        with run_metrics.stage('ingest') as stage:
+            read_in = export_cache.read_export(data_path)
+            stage.count = len(read_in)
+        config = job_config(job, read_in)
+        result = pds.process(read_in, config, job.get('workers', 1), run_metrics)
+        warnings = list(result.warnings)
+
+        with run_metrics.stage('write outputs') as stage:
+            written = write_outputs(config, result, outputs)
+            stage.count = len(result.rows)
+        part_rows = job.get('tmf901b_rows')
+        if job.get('tmf901b_pages'):
+            part_rows = job['tmf901b_pages'] * pds.PAGE_ROWS
+        if 'tmf901b' in outputs and part_rows:
+            warnings += pds.write_tmf901b_parts(
+                read_in, config, date.today().strftime("%d-%b-%Y"),
+                config.parts_path, part_rows, metrics=run_metrics
+                )
+            written.append(config.parts_path)
+        elif 'tmf901b' in outputs:
+            doc_path, doc_warnings = pds.generate_tmf901b(
+                read_in, config, date.today().strftime("%d-%b-%Y"),
+                metrics=run_metrics
+                )
+            written.append(doc_path)
+            warnings += doc_warnings
+
+    # the run report goes next to the formatted csv.
+    if 'csv' in outputs:
+        run_metrics.write_report(
+            config.report_path, study=config.study_name, version=pds.VERSION
+            )
+        written.append(config.report_path)
+
+    return written, warnings
+
+
+def run_incremental_job(job: dict, data_path: str, outputs: list) -> tuple:
+    '''
+    Bring the csv and TMF-901B of a PDS job up to date with the tests added
+    to its export since the last run. The csv is always written.
+    '''
+    read_in = None
+    if job.get('conditions') == 'search':
+        read_in = ingest.read_export(data_path, ['Test ID', 'Test Type'])
+    config = job_config(job, read_in)
+
+    update = incremental.update_study(
+        data_path, config, date.today().strftime("%d-%b-%Y"),
+        'tmf901b' in outputs
+        )
+
+    written = [config.csv_path] + write_outputs(
+        config, update.result, [o for o in outputs if o != 'csv']
+        )
+    if update.doc_path is not None:
+        written.append(update.doc_path)
+
+    return written, update.warnings
+
+
+def run_qc_job(job: dict) -> tuple:
+    '''
+    Build the TMF-901B for a QC lot. Returns the files written and the
+    warnings.
+    '''
+    # qcmain is only imported for QC jobs since it pulls in Streamlit.
+    import qcmain
+
+    test_objects, strip_image_dict, warnings = qcmain.read_in(
+        export_cache.read_export(job['data']), job.get('output'), [], []
+        )
+    document, doc_warnings = qcmain.generate_tmf901b(
+        test_objects, job['template'], strip_image_dict, job['filepath']
+        )
+    document.save(job['output'])
+
+    return [job['output']], warnings + doc_warnings
+
+
+def run_job(path: str) -> tuple:
+    '''
+    Run one job file. Returns the job path, the files written, the warnings
+    and the exception text if the job failed.
+    '''
+    try:
+        job = load_job(path)
+        if job.get('pipeline', 'PDS') == 'QC':
+            written, warnings = run_qc_job(job)
+        else:
+            written, warnings = run_pds_job(job)
+    except Exception as e:
+        return path, [], [], '{}: {}'.format(type(e).__name__, e)
+
+    return path, written, warnings, None
+
+
+def find_jobs(paths: list) -> list:
+    '''
+    Job files given directly or found in the given directories.
+    '''
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            jobs.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith('.json')
+                )
+        else:
+            jobs.append(path)
+    return jobs
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Run PDS and QC data processing jobs without the web app.'
+        )
+    parser.add_argument(
+        'jobs', nargs='+', help='job files or directories of job files'
+        )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of jobs to run at once (default: one per core)'
+        )
+    args = parser.parse_args(argv)
+
+    jobs = find_jobs(args.jobs)
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for path, written, warnings, error in pool.map(run_job, jobs):
+            if error is not None:
+                failed += 1
+                print('FAILED {}: {}'.format(path, error))
+                continue
+            print('done {}'.format(path))
+            for output in written:
+                print('    wrote {}'.format(output))
+            for warning in warnings:
+                print('    ' + ' '.join(warning.message.split()))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,463 @@
+'''
+Time the PDS and QC pipelines on synthetic reader exports so slowdowns show
+up before a large study does:
+
+    python benchmark.py --panel 9169 --reps 3 --conditions 4C,25C,37C
+    python benchmark.py --timepoints 20 --other-rows 50000 --output run.json
+    python benchmark.py --baseline run.json
+
+A synthetic TestResults.csv in the reader's column layout, matching
+strip_images folders and a blank TMF-901B are generated in a work folder,
+then every stage is run on them. The time (best of --repeat runs), the
+throughput and the peak memory traced during one more run are recorded for
+each stage. With --baseline, stages slower than the baseline by more than
+--tolerance are reported and the exit code is 1.
+'''
+import argparse
+import contextlib
+from datetime import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# keep the benchmark's thumbnails out of the user's cache. This has to be set
+# before strip_images is imported.
+THUMBNAIL_CACHE = os.path.join(tempfile.gettempdir(), 'pds_benchmark_thumbnails')
+os.environ['PDS_THUMBNAIL_CACHE'] = THUMBNAIL_CACHE
+
+import numpy as np
+import pandas as pd
+from docx import Document
+from PIL import Image
+
+import export_cache
+import ingest
+import panels
+import pds
+import replicate_stats
+import streaming
+import strip_images
+import writers
+
+
+PANELS = panels.names()
+
+# reader export header. pandas numbers the repeated Position columns.
+EXPORT_HEADER = [
+    'Test Number', 'Test ID', 'Test Type', 'Test Date', 'Time Acquired',
+    'Decision Title 1', 'Decision Message 1', 'Decision Title 2',
+    'Decision Message 2', 'Decision Title 3', 'Decision Message 3',
+    'Position', 'Position', 'Position'
+    ]
+QC_HEADER = ['Test No'] + EXPORT_HEADER[1:]
+
+TEST_TYPE = 'SediaBio HIV - Rapid Recency - v8'
+START = datetime(2021, 11, 4, 8, 0, 0)
+IMAGE_SIZE = (1600, 340)
+
+# pages per document of the split TMF-901B stage.
+PART_PAGES = 10
+
+
+def reader_values(n: int, rng: np.random.Generator, shift_rate: float = 0.02) -> dict:
+    '''
+    Line intensities and positions for n tests. A small share of the strips
+    get a shifted VER or LTR line so the position shift checks have work.
+    '''
+    ver_pos = rng.normal(315, 3, n).round()
+    ltr_pos = rng.normal(503, 3, n).round()
+    ver_pos[rng.random(n) < shift_rate] += 20
+    ltr_pos[rng.random(n) < shift_rate] += 30
+
+    return {
+        'Decision Title 1': 'Control',
+        'Decision Message 1': rng.uniform(1, 8, n),
+        'Decision Title 2': 'Verification',
+        'Decision Message 2': rng.uniform(0.5, 5, n),
+        'Decision Title 3': 'LT/R',
+        'Decision Message 3': rng.uniform(0.1, 4, n),
+        'Position': 100,
+        'Position.1': ver_pos,
+        'Position.2': ltr_pos,
+        }
+
+
+def acquired_columns(n: int) -> dict:
+    '''
+    Test Date and Time Acquired one second apart, so every test has its own
+    strip image folder.
+    '''
+    acquired = pd.date_range(START, periods=n, freq='s')
+    return {
+        'Test Date': acquired.strftime('%Y-%m-%d'),
+        'Time Acquired': acquired.strftime('%H:%M:%S'),
+        }
+
+
+def synthetic_export(
+    path: str, panel: list, rep_qty: int, conditions: list, other_rows: int = 0,
+    invalid_rate: float = 0.01, seed: int = 0
+    ) -> pd.DataFrame:
+    '''
+    Write a PDS TestResults.csv with every replicate of every panel member
+    under every condition, run one specimen after another, with other_rows
+    tests of other studies pooled in at random positions. A share of the
+    tests have no results, as when the reader rejects a strip. Returns the
+    export as written.
+    '''
+    rng = np.random.default_rng(seed)
+
+    ids = [
+        '{} {}-{}'.format(condition, specimen, rep + 1) if condition else
+        '{}-{}'.format(specimen, rep + 1)
+        for condition in (conditions or [''])
+        for specimen in panel
+        for rep in range(rep_qty)
+        ]
+    other = ['other {:05d}-{}'.format(i // 3, i % 3 + 1) for i in range(other_rows)]
+    ids = np.array(ids + other, dtype=object)
+    order = np.concatenate([
+        np.arange(len(ids) - other_rows),
+        rng.integers(0, len(ids) - other_rows + 1, other_rows) - 0.5
+        ]).argsort(kind='stable')
+    ids = ids[order]
+
+    n = len(ids)
+    df = pd.DataFrame({
+        'Test Number': np.arange(1, n + 1), 'Test ID': ids,
+        'Test Type': TEST_TYPE, **acquired_columns(n), **reader_values(n, rng)
+        })
+    df.loc[rng.random(n) < invalid_rate, 'Decision Message 1'] = np.nan
+
+    df.to_csv(path, index=False, header=EXPORT_HEADER, encoding=ingest.EXPORT_ENCODING)
+    return df
+
+
+def synthetic_qc_export(
+    path: str, sublots: int = 4, samples: int = 9, rep_qty: int = 3,
+    negatives: int = 10, retest_rate: float = 0.02, seed: int = 0
+    ) -> pd.DataFrame:
+    '''
+    Write a QC TestResults.csv following the QC Test ID naming: 'sublot_X.Y
+    Sample n' per sublot and replicate, negatives as 'N n' and some retests.
+    '''
+    rng = np.random.default_rng(seed)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+    ids = [
+        'sublot_{}.{} Sample {} rep {}'.format(
+            letters[lot // 26 % 26], letters[lot % 26], sample, rep + 1)
+        for lot in range(sublots)
+        for sample in range(1, samples + 1)
+        for rep in range(rep_qty)
+        ]
+    ids += ['N {}'.format(i + 1) for i in range(negatives)]
+    ids += [
+        test_id + ' retest' for test_id in ids
+        if not test_id.startswith('N') and rng.random() < retest_rate
+        ]
+
+    n = len(ids)
+    df = pd.DataFrame({
+        'Test No': np.arange(1, n + 1), 'Test ID': ids, 'Test Type': TEST_TYPE,
+        **acquired_columns(n), **reader_values(n, rng)
+        })
+
+    df.to_csv(path, index=False, header=QC_HEADER, encoding=ingest.EXPORT_ENCODING)
+    return df
+
+
+def synthetic_strip_images(directory: str, export: pd.DataFrame, seed: int = 0) -> int:
+    '''
+    Write a Strip.jpg into a strip_images folder for every test in export.
+    All strips share one encoded image, which is enough to time the reads.
+    '''
+    rng = np.random.default_rng(seed)
+    width, height = IMAGE_SIZE
+    strip = np.tile(np.linspace(180, 240, width, dtype=np.uint8), (height, 1))
+    strip = strip + rng.integers(0, 15, strip.shape, dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(strip).convert('RGB').save(buffer, 'JPEG', quality=92)
+
+    folders = [
+        strip_images.folder_name(d, t) for d, t in
+        zip(export['Test Date'], export['Time Acquired'])
+        ]
+    for folder in folders:
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+        with open(os.path.join(directory, folder, 'Strip.jpg'), 'wb') as f:
+            f.write(buffer.getvalue())
+
+    return len(folders)
+
+
+def blank_tmf901b(path: str, columns: int = 10):
+    '''
+    Save a stand-in for the blank TMF-901B: a header table with the date
+    stamp cell and a results table with one header row.
+    '''
+    document = Document()
+    document.add_table(rows=1, cols=5)
+    table = document.add_table(rows=1, cols=columns)
+    for i, name in enumerate(['Test No.', 'Test Date', 'Test ID', 'Line', 'Value']):
+        table.rows[0].cells[i].text = name
+    document.save(path)
+
+
+def clear_thumbnails():
+    shutil.rmtree(THUMBNAIL_CACHE, ignore_errors=True)
+
+
+def measure(
+    stage: str, func, count: int, unit: str = 'rows', repeat: int = 1,
+    before=None
+    ) -> tuple:
+    '''
+    Time func, best of repeat runs, then run it once more under tracemalloc
+    for its peak memory. before, if given, is called ahead of every run and
+    is not timed. Returns the result of the last run and the stage record.
+    '''
+    times = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    if before is not None:
+        before()
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(times)
+    return result, {
+        'stage': stage, 'seconds': seconds, 'count': count, 'unit': unit,
+        'throughput': count / seconds if seconds > 0 else float('inf'),
+        'peak_mb': peak / 2 ** 20
+        }
+
+
+def run_benchmark(
+    workdir: str, panel_name: str = '9169', rep_qty: int = 3,
+    conditions: list = None, other_rows: int = 0, repeat: int = 3,
+    images: bool = True, qc_sublots: int = 4, seed: int = 0
+    ) -> dict:
+    '''
+    Generate the synthetic study in workdir and time every stage on it.
+    Returns the parameters and the stage records.
+    '''
+    conditions = ['4C', '25C', '37C'] if conditions is None else conditions
+    filepath = os.path.join(workdir, '')
+    data_path = filepath + 'data.csv'
+    panel = panels.get_panel(panel_name).specimens
+
+    export = synthetic_export(data_path, panel, rep_qty, conditions, other_rows, seed=seed)
+    if images:
+        synthetic_strip_images(filepath + 'strip_images', export, seed)
+        blank_tmf901b(filepath + pds.TEMPLATE_NAME)
+
+    config = pds.PdsConfig(
+        study_name='benchmark', panel=panel, rep_qty=rep_qty,
+        conditions=conditions, other_data=other_rows > 0,
+        lots=['rep {}'.format(i + 1) for i in range(rep_qty)],
+        rep_stats=replicate_stats.STAT_KEYS, filepath=filepath
+        )
+    rows = len(export)
+    stages = []
+
+    def add(*args, **kwargs):
+        result, record = measure(*args, repeat=repeat, **kwargs)
+        stages.append(record)
+        return result
+
+    read_in = add('ingest', lambda: ingest.read_export(data_path), rows)
+    cache = export_cache.ExportCache(filepath + 'export_cache')
+    export_cache.read_export(data_path, cache)
+    add('ingest (cached)', lambda: export_cache.read_export(data_path, cache), rows)
+    data_matrix = add('filter', lambda: pds.relevant_data(read_in, config), rows)
+    stats_table, incomplete = add(
+        'replicate stats', lambda: pds.replicate_table(data_matrix, config),
+        len(data_matrix)
+        )
+    add(
+        'replicate stats (pool)',
+        lambda: pds.replicate_table(data_matrix, config, None, min_rows=0),
+        len(data_matrix)
+        )
+    result = add(
+        'format_data', lambda: pds.format_data(stats_table, incomplete, config),
+        len(stats_table), 'specimens'
+        )
+    add(
+        'csv export',
+        lambda: writers.write_rows(config.csv_path, result.headers, result.rows),
+        len(result.rows)
+        )
+    add(
+        'txt export',
+        lambda: writers.write_rows(
+            filepath + 'benchmark Formatted data.txt', result.headers,
+            result.rows, 'tsv'
+            ),
+        len(result.rows)
+        )
+    add(
+        'streaming format',
+        lambda: streaming.stream_format_data(
+            data_path, filepath + 'benchmark_streamed.csv', config
+            ),
+        rows
+        )
+
+    if images:
+        date_comp = START.strftime("%d-%b-%Y")
+        for stage, before in [('tmf901b pds (cold)', clear_thumbnails), ('tmf901b pds (cached)', None)]:
+            add(
+                stage, lambda: pds.generate_tmf901b(read_in, config, date_comp),
+                rows, 'images', before=before
+                )
+        add(
+            'tmf901b pds (parts)',
+            lambda: pds.write_tmf901b_parts(
+                read_in, config, date_comp, config.parts_path, PART_PAGES * pds.PAGE_ROWS
+                ),
+            rows, 'images'
+            )
+
+        # qcmain is only imported here since it pulls in Streamlit.
+        import qcmain
+
+        qc_export = synthetic_qc_export(filepath + 'qc.csv', qc_sublots, seed=seed)
+        qc_images = filepath + 'qc_strip_images'
+        synthetic_strip_images(qc_images, qc_export, seed)
+
+        def qc_tmf901b():
+            test_objects, strip_image_dict, _ = qcmain.read_in(
+                ingest.read_export(filepath + 'qc.csv'), None, [], []
+                )
+            document, warnings = qcmain.generate_tmf901b(
+                test_objects, filepath + pds.TEMPLATE_NAME, strip_image_dict,
+                qc_images
+                )
+            document.save(filepath + 'qc TMF-901B.docx')
+            return warnings
+
+        for stage, before in [('tmf901b qc (cold)', clear_thumbnails), ('tmf901b qc (cached)', None)]:
+            add(stage, qc_tmf901b, len(qc_export), 'images', before=before)
+        clear_thumbnails()
+
+    return {
+        'parameters': {
+            'panel': panel_name, 'rep_qty': rep_qty, 'conditions': conditions,
+            'other_rows': other_rows, 'rows': rows, 'repeat': repeat,
+            'images': images, 'seed': seed
+            },
+        'stages': stages
+        }
+
+
+def print_report(report: dict, baseline: dict = None, tolerance: float = 0.2) -> list:
+    '''
+    Print the stage records, and the change against baseline if given.
+    Returns the stages slower than the baseline by more than tolerance.
+    '''
+    before = {} if baseline is None else {s['stage']: s for s in baseline['stages']}
+    regressions = []
+    if baseline is not None and baseline['parameters'] != report['parameters']:
+        print('Baseline was run with different parameters: {}'.format(
+            baseline['parameters']))
+
+    print('{} rows: {}'.format(report['parameters']['rows'], report['parameters']))
+    print('{:<22}{:>10}{:>29}{:>10}{:>10}'.format(
+        'stage', 'seconds', 'throughput', 'peak MB', 'change'))
+    for s in report['stages']:
+        change = ''
+        if s['stage'] in before:
+            ratio = s['seconds'] / before[s['stage']]['seconds'] - 1
+            change = '{:+.0%}'.format(ratio)
+            if ratio > tolerance:
+                regressions.append(s['stage'])
+        print('{:<22}{:>10.3f}{:>16,.0f} {:<12}{:>10.1f}{:>10}'.format(
+            s['stage'], s['seconds'], s['throughput'], s['unit'] + '/s',
+            s['peak_mb'], change))
+
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipelines on synthetic reader exports.'
+        )
+    parser.add_argument('--panel', default='9169', choices=PANELS)
+    parser.add_argument('--reps', type=int, default=3, help='technical replicates')
+    parser.add_argument(
+        '--conditions', default='4C,25C,37C',
+        help='comma separated conditions, or "" for none'
+        )
+    parser.add_argument(
+        '--timepoints', type=int, default=1,
+        help='repeat every condition at this many timepoints'
+        )
+    parser.add_argument(
+        '--other-rows', type=int, default=0,
+        help='tests from other studies pooled into the export'
+        )
+    parser.add_argument('--qc-sublots', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage')
+    parser.add_argument(
+        '--no-images', action='store_true',
+        help='skip strip images and the TMF-901B stages'
+        )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='keep the generated study here')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='results json to compare against')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='slowdown against the baseline reported as a regression'
+        )
+    args = parser.parse_args(argv)
+
+    conditions = [c for c in args.conditions.split(',') if c]
+    if args.timepoints > 1:
+        conditions = [
+            '{} wk{}'.format(c, t + 1) for t in range(args.timepoints)
+            for c in conditions
+            ]
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(workdir, exist_ok=True)
+        report = run_benchmark(
+            workdir, args.panel, args.reps, conditions, args.other_rows,
+            args.repeat, not args.no_images, args.qc_sublots, args.seed
+            )
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        print('Slower than baseline: {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
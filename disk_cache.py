@@ -0,0 +1,58 @@
+'''
+Files kept in a cache directory by the export and strip thumbnail caches.
+Entries are written through a temporary file so readers never see a
+partial entry, and the least recently used entries are removed once the
+cache grows past its size limit. A cache is only an optimization, so
+failing to write or remove an entry is ignored.
+'''
+import contextlib
+import os
+import tempfile
+
+
+class DiskCache:
+    '''
+    Entries ending in suffix in directory. Reading an entry with touch marks
+    it as recently used.
+    '''
+    suffix = ''
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def touch(self, entry: str):
+        os.utime(entry)
+
+    def write(self, entry: str, write, errors: tuple = (OSError,)):
+        '''
+        Write entry with write(path), which may raise errors.
+        '''
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+        except OSError:
+            return
+        try:
+            write(tmp)
+            os.replace(tmp, entry)
+        except errors:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(self.suffix):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            total -= size
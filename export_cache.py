@@ -0,0 +1,122 @@
+'''
+On disk cache of parsed reader exports. The first time an export is read it
+is parsed with ingest.read_export and saved as an uncompressed Arrow IPC
+file named after the sha256 of the CSV. Later reads of the same content,
+from another Streamlit session, a batch job or the QC pipeline, memory-map
+that file instead of parsing the CSV text again.
+
+Test ID's are not parsed into the cache since how they split depends on the
+study's conditions and replicate naming. Entries are also keyed by a tag of
+the parsed columns and their types, so entries parsed by an older version
+of ingest are never served.
+'''
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from disk_cache import DiskCache
+import ingest
+
+
+CACHE_DIR = os.environ.get(
+    'PDS_EXPORT_CACHE',
+    os.path.join(Path.home(), '.cache', 'pds_data_processing', 'exports')
+    )
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# bump when the parsed frame changes in a way EXPORT_DTYPES does not show,
+# such as a new derived column.
+CACHE_VERSION = 1
+
+
+def file_digest(data: bytes) -> str:
+    '''
+    sha256 of an uploaded or local file, used as the cache key for its data.
+    '''
+    return hashlib.sha256(data).hexdigest()
+
+
+def schema_tag() -> str:
+    '''
+    Short digest of the columns and types read_export parses.
+    '''
+    schema = json.dumps(
+        [CACHE_VERSION, ingest.EXPORT_DTYPES, ingest.DATE_FORMAT],
+        sort_keys=True, default=str
+        )
+    return hashlib.sha256(schema.encode()).hexdigest()[:12]
+
+
+class ExportCache(DiskCache):
+    '''
+    Parsed exports keyed by the digest of their CSV and the schema tag.
+    Entries of another schema are left to be evicted. Reading an entry marks
+    it as recently used, and the least recently used entries are removed
+    once the cache grows past max_bytes.
+    '''
+    suffix = '.arrow'
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        self.tag = schema_tag()
+
+    def entry(self, digest: str) -> str:
+        return os.path.join(self.directory, '{}_{}.arrow'.format(digest, self.tag))
+
+    def get(self, digest: str):
+        entry = self.entry(digest)
+        try:
+            # the mapping stays open for as long as the frame's buffers use it.
+            table = pa.ipc.open_file(pa.memory_map(entry)).read_all()
+            self.touch(entry)
+        except (OSError, pa.ArrowInvalid):
+            return None
+        # one block per column, so the columns are views of the mapping
+        # rather than copied into consolidated blocks.
+        return table.to_pandas(split_blocks=True)
+
+    def put(self, digest: str, df: pd.DataFrame):
+        def write(path):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            # keep NaN as a value rather than a null, so float columns with
+            # missing results are read back without a copy too.
+            for i, field in enumerate(table.schema):
+                if pa.types.is_floating(field.type):
+                    values = pa.array(df[field.name].to_numpy(), from_pandas=False)
+                    table = table.set_column(i, field, values)
+            with pa.OSFile(path, 'wb') as f:
+                with pa.ipc.new_file(f, table.schema) as writer:
+                    writer.write_table(table)
+
+        self.write(self.entry(digest), write, (OSError, pa.ArrowException))
+        self.evict()
+
+
+def load_export(data: bytes, digest: str = None, cache: ExportCache = None) -> pd.DataFrame:
+    '''
+    Parsed export of the CSV content in data, from the cache if it was
+    parsed before. digest can be passed if it is already known.
+    '''
+    cache = ExportCache() if cache is None else cache
+    digest = file_digest(data) if digest is None else digest
+
+    df = cache.get(digest)
+    if df is None:
+        df = ingest.read_export(io.BytesIO(data))
+        cache.put(digest, df)
+    return df
+
+
+def read_export(path: str, cache: ExportCache = None) -> pd.DataFrame:
+    '''
+    Parsed export of the CSV file at path, from the cache if the same
+    content was parsed before.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_export(data, cache=cache)
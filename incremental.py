@@ -0,0 +1,226 @@
+'''
+Incremental processing of a reader export that keeps growing during a study.
+The state of each study is kept next to its outputs, in
+'{study}_incremental.pkl': how far into data.csv it has been processed
+(byte offset, and the bytes of the last row processed), the relevant rows
+read so far and the replicate stats table. Each update only parses the rows
+added since, recomputes the stats of the specimens those rows belong to,
+rewrites the formatted CSV from the stats table and appends the new tests
+to the TMF-901B.
+
+The export is processed from scratch if it was replaced rather than appended
+to, or if a setting that changes which rows are used was changed.
+'''
+from dataclasses import dataclass, replace
+import io
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+
+import ingest
+import pds
+from progress import Progress
+import replicate_stats
+import writers
+
+
+KEY_COLUMNS = replicate_stats.KEY_COLUMNS
+
+
+@dataclass
+class StudyState:
+    '''
+    What has been processed of a study's export. config is the PdsConfig it
+    was processed with, less the settings that only change the formatting.
+    '''
+    config: pds.PdsConfig
+    header: bytes
+    offset: int
+    last_line: bytes
+    rows: pd.DataFrame
+    table: pd.DataFrame
+    first_seen: dict
+    incomplete: dict
+    doc_synced: bool = False
+
+
+@dataclass
+class IncrementalResult:
+    '''
+    Formatted data of the whole study, the tests added by this update and
+    the TMF-901B, if one was made. rebuilt is set when the export had to be
+    processed from scratch.
+    '''
+    result: pds.PdsResult
+    new_tests: pd.DataFrame
+    rebuilt: bool
+    doc_path: str
+    warnings: list
+
+
+def state_path(config: pds.PdsConfig) -> str:
+    return config.filepath + '{}_incremental.pkl'.format(config.study_name)
+
+
+def state_config(config: pds.PdsConfig) -> pds.PdsConfig:
+    # lots, stats and shift limits only change the formatting, which is
+    # redone every update.
+    return replace(config, lots=(), rep_stats=(), shift_limits=None)
+
+
+def load_state(path: str, config: pds.PdsConfig):
+    '''
+    Saved state of a study, or None if there is none or it was processed
+    with different settings.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+    if not isinstance(state, StudyState) or state.config != state_config(config):
+        return None
+    return state
+
+
+def save_state(path: str, state: StudyState):
+    # write to a temporary file first so an interrupted save keeps the old state.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp, path)
+
+
+def appended_to(source: str, state: StudyState) -> bool:
+    '''
+    Whether the export still starts with everything already processed, by
+    checking its header and the last processed row.
+    '''
+    with open(source, 'rb') as f:
+        if f.readline() != state.header:
+            return False
+        f.seek(state.offset - len(state.last_line))
+        return f.read(len(state.last_line)) == state.last_line
+
+
+def read_new_rows(source: str, header: bytes, offset: int, stop: int = None) -> tuple:
+    '''
+    Parse the complete rows of the export between offset and stop (the end
+    of the file by default). A row still being written is left for the next
+    update. Returns the rows, the new offset and the last complete row.
+    '''
+    with open(source, 'rb') as f:
+        f.seek(offset)
+        data = f.read(-1 if stop is None else stop - offset)
+
+    end = data.rfind(b'\n') + 1
+    data = data[:end]
+    last_line = data[data.rfind(b'\n', 0, end - 1) + 1:end]
+
+    new = ingest.read_export(io.BytesIO(header + data))
+    return new, offset + end, last_line
+
+
+def empty_state(source: str, config: pds.PdsConfig) -> StudyState:
+    with open(source, 'rb') as f:
+        header = f.readline()
+
+    return StudyState(
+        config=state_config(config), header=header, offset=len(header),
+        last_line=header, rows=None, table=None, first_seen={}, incomplete={}
+        )
+
+
+def update_table(state: StudyState, new: pd.DataFrame, config: pds.PdsConfig):
+    '''
+    Add the relevant rows of new to the state and recompute the replicate
+    stats of the specimens they belong to.
+    '''
+    data = pds.relevant_data(new, config)
+    keys = data[KEY_COLUMNS]
+
+    state.rows = data if state.rows is None else pd.concat([state.rows, data])
+
+    affected = list(dict.fromkeys(zip(keys['Condition'], keys['Specimen'])))
+    if len(affected) == 0 and state.table is not None:
+        return
+    for key in affected:
+        state.first_seen.setdefault(key, len(state.first_seen))
+
+    row_keys = pd.MultiIndex.from_frame(state.rows[['Condition', 'Specimen']])
+    rows = state.rows[row_keys.isin(affected)]
+    table, _ = replicate_stats.compute_replicate_stats(
+        rows[replicate_stats.DATA_COLUMNS], config.rep_qty, config.conditions,
+        config.multiple_conditions, config.reps_in_title, rows[KEY_COLUMNS]
+        )
+
+    # specimens with duplicated or missing replicates so far.
+    sizes = rows.groupby(['Condition', 'Specimen'], sort=False).size()
+    for key in affected:
+        state.incomplete.pop(key, None)
+    for key, size in sizes.items():
+        if size != config.rep_qty and (key[0] or not config.multiple_conditions):
+            state.incomplete[key] = ' '.join(i for i in key if i)
+
+    if state.table is not None:
+        table_keys = pd.MultiIndex.from_frame(state.table[['Condition', 'Specimen']])
+        table = pd.concat([state.table[~table_keys.isin(affected)], table])
+
+    # same order as compute_replicate_stats: by condition, then first appearance.
+    rank = {c: i for i, c in reversed(list(enumerate(config.conditions)))}
+    order = pd.DataFrame({
+        'rank': table['Condition'].map(rank).fillna(0).to_numpy(),
+        'seen': [state.first_seen[k] for k in zip(table['Condition'], table['Specimen'])]
+        })
+    order = order.sort_values(['rank', 'seen'], kind='stable').index
+    state.table = table.iloc[order].reset_index(drop=True)
+
+
+def update_study(
+        source: str, config: pds.PdsConfig, date_comp: str = None,
+        tmf901b: bool = False, version: str = pds.VERSION,
+        progress: Progress = None, rebuild: bool = False
+        ) -> IncrementalResult:
+    '''
+    Bring a study's formatted CSV, and its TMF-901B if tmf901b is set, up to
+    date with its export at source, processing only the rows added since the
+    last update.
+    '''
+    path = state_path(config)
+    state = None if rebuild else load_state(path, config)
+    rebuilt = state is None or not appended_to(source, state)
+    if rebuilt:
+        state = empty_state(source, config)
+
+    new, state.offset, last_line = read_new_rows(source, state.header, state.offset)
+    if len(new) > 0:
+        state.last_line = last_line
+
+    update_table(state, new, config)
+    result = pds.format_data(state.table, list(state.incomplete.values()), config)
+    writers.write_rows(config.csv_path, result.headers, result.rows)
+
+    warnings = list(result.warnings)
+    doc_path = None
+    if tmf901b:
+        if state.doc_synced and os.path.exists(config.doc_path):
+            doc_path, doc_warnings = pds.append_tmf901b(
+                new, config, date_comp, version, progress
+                )
+        else:
+            # every test processed so far goes in a new document.
+            export = new if rebuilt else read_new_rows(
+                source, state.header, len(state.header), state.offset
+                )[0]
+            doc_path, doc_warnings = pds.generate_tmf901b(
+                export, config, date_comp, version, progress
+                )
+        warnings += doc_warnings
+    state.doc_synced = tmf901b
+
+    save_state(path, state)
+
+    return IncrementalResult(result, new, rebuilt, doc_path, warnings)
@@ -0,0 +1,88 @@
+import pandas as pd
+
+
+EXPORT_ENCODING = 'cp1252'
+
+# Reader export columns used by the PDS and QC pipelines and their types.
+# The reader repeats the 'Position' header, so pandas numbers the repeats.
+EXPORT_DTYPES = {
+    'Test Number': 'Int64', 'Test No': 'Int64', 'Test ID': str,
+    'Test Type': str, 'Test Date': str, 'Time Acquired': str,
+    'Decision Title 2': str, 'Decision Title 3': str,
+    'Decision Message 1': 'float64', 'Decision Message 2': 'float64',
+    'Decision Message 3': 'float64', 'Position.1': 'float64',
+    'Position.2': 'float64'
+    }
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _rewind(source):
+    # uploaded files are read twice, once for the header.
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def _read_options(source, columns: list) -> dict:
+    '''
+    Column selection and types passed to pd.read_csv for an export.
+    '''
+    wanted = EXPORT_DTYPES if columns is None else columns
+
+    _rewind(source)
+    header = pd.read_csv(source, nrows=0, encoding=EXPORT_ENCODING).columns
+    _rewind(source)
+
+    # select by position since pandas renames repeated headers after usecols.
+    usecols = [i for i, name in enumerate(header) if name in wanted]
+    dtype = {
+        name: EXPORT_DTYPES[name] for name in header
+        if name in wanted and name in EXPORT_DTYPES
+        }
+
+    return {
+        'usecols': usecols, 'dtype': dtype, 'encoding': EXPORT_ENCODING,
+        'engine': 'c'
+        }
+
+
+def _add_acquired(df: pd.DataFrame) -> pd.DataFrame:
+    if 'Test Date' in df and 'Time Acquired' in df:
+        df['Acquired'] = parse_acquired(df['Test Date'], df['Time Acquired'])
+    return df
+
+
+def read_export(source, columns: list = None) -> pd.DataFrame:
+    '''
+    Read a TestResults.csv export from the test strip reader. Only the columns
+    used by the pipelines are parsed, each with an explicit type, using the C
+    parser. Test Date and Time Acquired are also parsed once into an
+    'Acquired' datetime column. Columns missing from the export are skipped
+    so PDS and QC exports can share this function.
+
+    source can be a file path or a file-like object such as a Streamlit upload.
+    '''
+    df = pd.read_csv(source, **_read_options(source, columns))
+    return _add_acquired(df)
+
+
+def iter_export(source, chunksize: int, columns: list = None):
+    '''
+    Read an export chunksize rows at a time with the same columns and types
+    as read_export. Yields DataFrames.
+    '''
+    options = _read_options(source, columns)
+    with pd.read_csv(source, chunksize=chunksize, **options) as reader:
+        for chunk in reader:
+            yield _add_acquired(chunk)
+
+
+def parse_acquired(test_date: pd.Series, time_acquired: pd.Series) -> pd.Series:
+    '''
+    Combine Test Date (YYYY-MM-DD) and Time Acquired (HH:MM:SS, 24hr) into
+    datetimes. Rows that do not follow the format become NaT.
+    '''
+    return pd.to_datetime(
+        test_date.str.strip() + ' ' + time_acquired.str.strip(),
+        format=DATE_FORMAT, errors='coerce'
+        )
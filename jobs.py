@@ -0,0 +1,256 @@
+'''
+Background TMF-901B builds for the Streamlit app. Documents are built in a
+pool of worker processes shared by every session of the app, so building a
+document neither blocks the session that asked for it nor the sessions of
+other users, and several documents can build at once.
+
+submit returns a Job with a short job ID. Workers report progress into a
+dict shared through a multiprocessing manager, which the app reads with
+progress while it shows the job. A finished job's result is the docx as
+bytes, the warnings of the build and the metrics of its stages.
+'''
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+import io
+import multiprocessing
+import os
+import threading
+import uuid
+
+import metrics
+from metrics import RunMetrics
+from progress import Progress
+
+
+MAX_WORKERS = 4
+
+# finished jobs kept in a session until they are downloaded.
+MAX_FINISHED = 5
+
+_lock = threading.Lock()
+_executor = None
+_progress = None
+
+
+@dataclass
+class Job:
+    '''
+    A submitted build. file_name is the name the document is offered under.
+    If report_path is set, the build's stages are added to the report of
+    the run started at started once it finishes.
+    '''
+    job_id: str
+    file_name: str
+    future: Future
+    report_path: str = None
+    started: str = None
+
+
+class SharedProgress(Progress):
+    '''
+    Writes updates to a dict shared with the app, under the job's ID.
+    '''
+    def __init__(self, shared, job_id: str):
+        self.shared = shared
+        self.job_id = job_id
+
+    def update(self, stage: str, done: int, total: int):
+        self.shared[self.job_id] = (stage, done, total)
+
+
+def start_pool() -> ProcessPoolExecutor:
+    # workers are spawned rather than forked since the app's server runs
+    # several threads.
+    context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=context)
+
+
+def executor() -> tuple:
+    '''
+    The process-wide worker pool and shared progress dict, started on first
+    use.
+    '''
+    global _executor, _progress
+    with _lock:
+        if _executor is None:
+            _progress = multiprocessing.get_context('spawn').Manager().dict()
+            _executor = start_pool()
+    return _executor, _progress
+
+
+def restart(pool: ProcessPoolExecutor):
+    '''
+    Replace the worker pool, unless another session replaced it already. A
+    pool is broken for good once one of its workers dies, for example when
+    the OS kills it building a huge document, and the jobs it was running
+    have failed.
+    '''
+    global _executor
+    with _lock:
+        if _executor is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            _executor = start_pool()
+
+
+def run(build, job_id: str, shared, *args) -> tuple:
+    '''
+    Run a build function in a worker. Returns the docx bytes, the warnings
+    and the stage metrics.
+    '''
+    run_metrics = RunMetrics()
+    data, warnings = build(*args, SharedProgress(shared, job_id), run_metrics)
+    return data, warnings, run_metrics.table()
+
+
+def pds_tmf901b(df, config, date_comp: str, version: str, progress, run_metrics) -> tuple:
+    # imported here so the workers do not import Streamlit through the app.
+    import pds
+
+    document, warnings = pds.build_tmf901b(
+        df, config, date_comp, version, progress, run_metrics
+        )
+    # the document is also kept with the study, from the same bytes.
+    with run_metrics.stage('tmf901b save'):
+        data = pds.document_bytes(document)
+        with open(config.doc_path, 'wb') as f:
+            f.write(data)
+    return data, warnings
+
+
+def pds_tmf901b_parts(
+        df, config, date_comp: str, version: str, part_rows: int, progress,
+        run_metrics
+        ) -> tuple:
+    import pds
+
+    # the part builds of the jobs running at once share the cores.
+    buffer = io.BytesIO()
+    warnings = pds.write_tmf901b_parts(
+        df, config, date_comp, buffer, part_rows, version, progress, run_metrics,
+        workers=max(1, os.cpu_count() // MAX_WORKERS)
+        )
+    data = buffer.getvalue()
+    with open(config.parts_path, 'wb') as f:
+        f.write(data)
+    return data, warnings
+
+
+def qc_tmf901b(test_objects, template: bytes, filepath: str, progress, run_metrics) -> tuple:
+    import pds
+    import qcmain
+
+    with run_metrics.stage('tmf901b images', 'images') as stage:
+        document, warnings = qcmain.generate_tmf901b(
+            test_objects, template, {}, filepath, progress
+            )
+        skipped = [
+            w.items for w in warnings
+            if w.kind in (pds.MISSING_IMAGES, pds.AMBIGUOUS_IMAGES)
+            ]
+        stage.count = len(test_objects) - sum(map(len, skipped))
+    with run_metrics.stage('tmf901b save'):
+        data = pds.document_bytes(document)
+    return data, warnings
+
+
+def submit(file_name: str, build, *args) -> Job:
+    '''
+    Queue a build function (pds_tmf901b, pds_tmf901b_parts or qc_tmf901b)
+    with its arguments, which are sent to a worker process, so they have to
+    pickle.
+    '''
+    pool, shared = executor()
+    job_id = uuid.uuid4().hex[:8]
+    shared[job_id] = ('Queued', 0, 1)
+    try:
+        future = pool.submit(run, build, job_id, shared, *args)
+    except BrokenProcessPool:
+        restart(pool)
+        pool, _ = executor()
+        future = pool.submit(run, build, job_id, shared, *args)
+    return Job(job_id, file_name, future)
+
+
+def progress(job: Job) -> tuple:
+    '''
+    Last (stage, done, total) update of a job.
+    '''
+    _, shared = executor()
+    return shared.get(job.job_id, ('Queued', 0, 1))
+
+
+def forget(key: str, job_id: str):
+    '''
+    Drop a job from the session under key, and its progress, so its result
+    is not kept once it is no longer offered.
+    '''
+    import streamlit as sl
+
+    _, shared = executor()
+    shared.pop(job_id, None)
+    sl.session_state[key] = [j for j in sl.session_state.get(key, []) if j.job_id != job_id]
+
+
+def prune(key: str):
+    '''
+    Forget all but the last MAX_FINISHED finished jobs of the session.
+    '''
+    import streamlit as sl
+
+    finished = [j for j in sl.session_state.get(key, []) if j.future.done()]
+    for job in finished[:-MAX_FINISHED]:
+        forget(key, job.job_id)
+
+
+def show_jobs(key: str):
+    '''
+    Show the jobs kept in the session under key: a progress bar while a job
+    runs, then its warnings and a download button. The jobs are refreshed
+    every second while one of them is running. A job is forgotten once it is
+    downloaded, or when more than MAX_FINISHED jobs have finished.
+    '''
+    import streamlit as sl
+    from progress import StreamlitProgress
+
+    def panel():
+        for job in sl.session_state.get(key, []):
+            sl.write('TMF-901B job {}: {}'.format(job.job_id, job.file_name))
+            if not job.future.done():
+                StreamlitProgress().update(*progress(job))
+                continue
+
+            error = job.future.exception()
+            if error is not None:
+                sl.error('Job {} failed: {}'.format(job.job_id, error))
+                continue
+
+            data, warnings, stages = job.future.result()
+            if job.report_path is not None:
+                metrics.add_stages(job.report_path, stages, job.started)
+                job.report_path = None
+            for warning in warnings:
+                sl.error(warning.message)
+            images = [s for s in stages if s['unit'] == 'images']
+            if images and images[0]['throughput'] is not None:
+                sl.caption('{} strip images in {:.1f} s ({:.0f} images/s).'.format(
+                    images[0]['count'], images[0]['seconds'], images[0]['throughput']
+                    ))
+            sl.download_button(
+                'Download completed TMF-901B', data, job.file_name,
+                key='download {}'.format(job.job_id), on_click=forget,
+                args=(key, job.job_id)
+                )
+
+    @sl.fragment(run_every=1)
+    def poll():
+        panel()
+        # rerun the app once the last job finishes, so the jobs stop polling.
+        if all(j.future.done() for j in sl.session_state.get(key, [])):
+            sl.rerun()
+
+    prune(key)
+    if all(j.future.done() for j in sl.session_state.get(key, [])):
+        panel()
+    else:
+        poll()
@@ -1,568 +1,203 @@
 import csv
+from dataclasses import replace
 from datetime import date
-import re
+import os
 
 import pandas as pd
 import streamlit as sl
-from docx import Document
-from scipy import stats as st
 
-import specimen_bank
+import export_cache
+import ingest
+import pds
+import incremental
+import jobs
+import metrics
+import panels
+import progress
 import qcmain
-
-
-class TestClass:
-    '''
-    Class used to store all test data relevant to each specimen tested, 
-    including replicate values and all stats. Replicates are grouped under
-    the shared specimen used. For example, if specimen Boca124 is tested
-    with three replicates, there will be one object for this specimen
-    containing all three replicates saved, as well as stats such as mean
-    and standard deviation of the replicates. Strip scoring data such as
-    search and scoring window coordinates are also stored. 
-    '''
-    def __init__(self, formatted_data, rep_qty, index, c=0, condition=""):  
-
-        self.fd = formatted_data
-        self.qty = rep_qty
-        self.index = index
-        self.ltr_pos = []
-        self.ver_pos = []
-
-        # add line scoring positions
-        for i in range(3):
-            self.ltr_pos.append(formatted_data[index+i][5])
-            self.ver_pos.append(formatted_data[index+i][4])
-
-        if reps_in_title == True:
-            self.name = self.fd[self.index][0][c:-2]  
-        else: 
-            self.fd[self.index][0][c:]
-        self.condition = condition
-
-        # Control line stats
-        ctrl_data = []
-        
-        for j in range(self.qty):
-            ctrl_data.append(round(float(self.fd[self.index + j][1]), 3))
-
-        self.ctrl_mean = round(stats.mean(ctrl_data), 3)
-        self.ctrl_median = round(stats.median(ctrl_data), 3)
-        self.ctrl_SD = round(stats.stdev(ctrl_data), 3)
-        self.ctrl_CV = round((self.ctrl_SD / self.ctrl_mean) * 100, 1)
-        ctrl_MAD_list = [abs(k - self.ctrl_median) for k in ctrl_data]
-        self.ctrl_MAD = round(stats.median(ctrl_MAD_list), 3)
-        self.ctrl_data = ctrl_data
-        
-        # VER line stats
-        ver_data = []
-        
-        try:
-            for j in range(self.qty):
-                ver_data.append(round(float(self.fd[self.index + j][2]), 3))
-        except IndexError:
-            sl.error(
-                    '''Could not format data. A replicate may be duplicated 
-                        or missing for {}.'''.format(self.name)
-                        )
-            
-        self.ver_mean = round(stats.mean(ver_data), 3)
-        self.ver_median = round(stats.median(ver_data), 3)
-        self.ver_SD = round(stats.stdev(ver_data), 3)
-        self.ver_CV = round((self.ver_SD / self.ver_mean) * 100, 1)
-        ver_MAD_list = [abs(k - self.ver_median) for k in ver_data]
-        self.ver_MAD = round(stats.median(ver_MAD_list), 3)
-        self.ver_data = ver_data
-
-        # LT/R line stats
-        ltr_data = []
-        for j in range(self.qty):
-            ltr_data.append(round(float(self.fd[self.index + j][3]), 3))
-
-        self.ltr_mean = round(stats.mean(ltr_data), 3)
-        self.ltr_median = round(stats.median(ltr_data), 3)
-        self.ltr_SD = round(stats.stdev(ltr_data), 3)
-        self.ltr_CV = round((self.ltr_SD / self.ltr_mean) * 100, 1)
-        ltr_MAD_list = [abs(k - self.ltr_median) for k in ltr_data]
-        self.ltr_MAD = round(stats.median(ltr_MAD_list), 3)
-        self.ltr_data = ltr_data
-
-
-def get_conditions(read_in: list) -> list:
+import replicate_stats
+import shifts
+import streaming
+import writers
+
+
+# Streamlit reruns this script on every widget change. The functions below
+# are memoized on the export's digest and the parameters they depend on, so
+# only the steps whose inputs changed are recomputed. Arguments starting
+# with an underscore are not hashed by Streamlit.
+@sl.cache_data(show_spinner=False, max_entries=8)
+def load_export(digest: str, _data: bytes) -> pd.DataFrame:
     '''
-    Parse test ID's from imported csv file for experimental conditions.
-    Conditions must follow naming convention in documentation.
+    Parse the export once per file content. Exports parsed in other sessions
+    are memory-mapped from the export cache.
     '''
-    sample_ID = read_in['Test ID'].values
-    test_type = read_in['Test Type'].values
-    
-    pattern = '[A-Za-z0-9]+ '
-    condition_list = []
-    
-    for i, test in enumerate(sample_ID):
-        if test_type[i] == 'SediaBio HIV - Rapid Recency - v8':
-            result = re.findall(pattern, test)
-            if len(result) > 0:
-                find = result[0]
-                condition = find.replace(' ', '')
-                if condition not in condition_list:
-                    condition_list.append(condition)
-            
-    return condition_list
-        
+    return export_cache.load_export(_data, digest)
 
-def shapiro(data: list) -> str:
-    '''
-    Perform a Shapiro-Wilk test on test line values to test if values
-    come from a normal distribution. Return the p-value. 
-    '''
-    result = st.shapiro(data)
-    return result[1] # p value
 
+@sl.cache_data(show_spinner=False, max_entries=8)
+def cached_conditions(digest: str, _read_in: pd.DataFrame) -> list:
+    return pds.get_conditions(_read_in)
 
-def remove_nan(data_matrix: list) -> list:
-    '''
-    Removes any NA values from the data. 
-    '''
-    dm = []
-    for i in data_matrix:
-        if pd.isna(i[1]):
-            pass
-        else:
-            dm.append(i)
-    return dm
-
-
-def remove_irrelevant_testing(data_matrix: list, panel: list, condition_list: list) -> list:
-    '''
-    Uses the panel tested and list of experimental conditions to remove irrelevant
-    data from the data matrix. This was implemented because data from multiple 
-    users can be pooled in the exported data by the test strip reader. 
-
-    This function can be bypassed if desired by setting the "is there other data
-    present" to no in the network GUI. 
-    '''
-    relevant_data = []
-    if multiple_conditions == True:
-        # remove tests that are not in panel.
-        if reps_in_title == True:
-            for condition in condition_list:
-                c = len(condition) + 1
-                for test in data_matrix:
-                    if test[0][c:-2] in panel and condition == test[0][:c - 1]:
-                        relevant_data.append(test)            
-            return relevant_data
-        else:
-            for condition in condition_list:
-                c = len(condition) + 1
-                for test in data_matrix:
-                    if test[0][c:] in panel and condition in test[0]:
-                        relevant_data.append(test)
-            return relevant_data
-        
-    else:
-        if reps_in_title == True:
-            for test in data_matrix:
-                if test[0][:-2] in panel:
-                    relevant_data.append(test)
-
-            return relevant_data
-        else:
-            for test in data_matrix:
-                if test[0] in panel:
-                    relevant_data.append(test)
-            return relevant_data
-
-
-def format_data(
-    dm: list, rep_qty: int, lots: list, condition_list: list, lines: list, rep_stats: list
-    ) -> list:
-    '''
-    Creates test objects as an instance of the TestClass for each specimen run.
-    Returns a formatted table for verification and LTR values as atributes of 
-    the test object.
-    '''
-    test_objects = []
-
-    data_for_csv = []
-    headers = []
-    cc_message = []
-    ct_message = []
-
-    if multiple_conditions == True:
-
-        for line in lines:
-            headers.append('Condition')
-            headers.append(" ".join([line, '|', 'Sample']))
-            for lot in lots:
-                headers.append(lot)
-            for stat in rep_stats:
-                headers.append(stat)
-            headers.append(' ')
-
-        for condition in condition_list:
-            c = len(condition) + 1
-
-            for i in range(0, len(dm) - 2, rep_qty):
-                if condition == dm[i][0][:c - 1]:
-                    
-                    test = TestClass(dm, rep_qty, i, c, condition)
-
-                    test_objects.append(test)
-                    data = []
-
-                # CTRL vals                  
-                    data.append(test.condition)
-                    data.append(test.name)
-                    for d in test.ctrl_data:
-                        data.append(d)
-
-                    ctrl_stats = {
-                        'Mean':test.ctrl_mean, 'SD':test.ctrl_SD, 
-                        '%CV':test.ctrl_CV, 'Median':test.ctrl_median, 
-                        'MAD':test.ctrl_MAD
-                        }
-                    for stat in rep_stats:
-                        data.append(ctrl_stats[stat])
-
-                    data.append(' ')
-
-                    # VER values
-                    data.append(test.condition)
-                    data.append(test.name)
-                    for d in test.ver_data:
-                        data.append(d)
-
-                    ver_stats = {
-                        'Mean':test.ver_mean, 'SD':test.ver_SD, 
-                        '%CV':test.ver_CV, 'Median':test.ver_median, 
-                        'MAD':test.ver_MAD
-                        }
-                    for stat in rep_stats:
-                        data.append(ver_stats[stat])
-
-                    data.append(' ')
-
-                    # LTR values
-                    if test_lines == 2:
-                        data.append(test.condition)
-                        data.append(test.name)
-                        for n in test.ltr_data:
-                            data.append(n)
-
-                        ltr_stats = {
-                            'Mean':test.ltr_mean, 'SD':test.ltr_SD, 
-                            '%CV':test.ltr_CV, 'Median':test.ltr_median, 
-                            'MAD':test.ltr_MAD
-                            }
-                        for stat in rep_stats:
-                            data.append(ltr_stats[stat])
-                        
-
-                if len(data) > 0 and data not in data_for_csv:
-                    data_for_csv.append(data)
-                    
-            data_for_csv.append([' '])
-
-    elif multiple_conditions == False:
-        for line in lines:
-            headers.append(" ".join([line, '|', 'Sample']))
-            for lot in lots:
-                headers.append(lot)
-            for stat in rep_stats:
-                headers.append(stat)
-            headers.append(' ')
-
-        # test_objects = []
-        condition = ""
-        c = 0
-
-        for i in range(0, len(dm) - 2, rep_qty):
-
-            test = TestClass(dm, rep_qty, i, c, condition)
-            test_objects.append(test)
-
-            data = []
-
-            #ctrl values
-            data.append(test.name)
-            for n in test.ctrl_data:
-                data.append(n)
-            ctrl_stats = {
-                'Mean':test.ctrl_mean, 'SD':test.ctrl_SD, '%CV':test.ctrl_CV, 
-                'Median':test.ctrl_median, 'MAD':test.ctrl_MAD
-                }
-            for stat in rep_stats:
-                data.append(ctrl_stats[stat])
-            data.append(' ')
-            
-            
-            #Ver Values
-            data.append(test.name)
-            for n in test.ver_data:
-                data.append(n)
-            ver_stats = {
-                'Mean':test.ver_mean, 'SD':test.ver_SD, '%CV':test.ver_CV, 
-                'Median':test.ver_median, 'MAD':test.ver_MAD
-                }
-            for stat in rep_stats:
-                data.append(ver_stats[stat])
-            data.append(' ')
-
-            # LTR values
-            if test_lines == 2:
-                data.append(test.name)
-                for n in test.ltr_data:
-                    data.append(n)
-                ltr_stats = {
-                    'Mean':test.ltr_mean, 'SD':test.ltr_SD, '%CV':test.ltr_CV,
-                    'Median':test.ltr_median, 'MAD':test.ltr_MAD
-                    }
-                for stat in rep_stats:
-                    data.append(ltr_stats[stat])
-
-            if len(data) > 0:
-                data_for_csv.append(data)
-
-        data_for_csv.append([' '])
-
-
-    # Check for color creep
-    for test in test_objects:
-        for i,_ in enumerate(test.ltr_pos):
-            if int(test.ltr_pos[i]) > 530:
-                cc_message.append(test.condition + ' ' + test.name + ' strip #' + str(i+1))
-        for i,_ in enumerate(test.ver_pos):
-            if int(test.ver_pos[i]) > 330:
-                ct_message.append(test.condition + ' ' + test.name + ' strip #' + str(i+1))
-            
-    if len(cc_message) > 0:
-        sl.error(
-            '''Significant position shift for LTR line detected in the 
-            following samples: {}. Color creep or covertape may have been 
-            mistaken for the LTR line.'''.format(', '.join(cc_message)))
-    if len(ct_message) > 0:
-        sl.error(
-            '''Significant position shift for VER line detected in the 
-            following samples: {}. Covertape is likely in strip image.
-            '''.format(', '.join(ct_message)))
-
-    return headers, data_for_csv, test_objects
-
-
-# generate test strip image doc from date and time of test
-def generate_tmf901b(
-        df, filepath, panel, test_lines, rep_qty, condition_list, date_comp, 
-        version
-        ):
-
-
-    clen = len(condition_list) if len(condition_list) > 0 else 1
-
-    sl.spinner('Generating TMF-901B...')
-    time = df['Time Acquired'].values
-    date = df['Test Date'].values
-    test_no = df['Test Number'].values
-    test_ID = df['Test ID'].values
-    ver = df['Decision Title 2'].values
-    ver_value = df['Decision Message 2'].values
-    expected_strip_ct = len(panel) * rep_qty * clen
-
-    if test_lines == 2:
-        ltr = df['Decision Title 3'].values
-        ltr_value = df['Decision Message 3'].values
-    test_type = df['Test Type'].values
-
-    test_to_ignore = [
-        'Instrument Check, Visual, Red/Gold', 'ROF QC Test - Negative', 
-        'ROF QC Test - Positive', 'QC Test - Negative', 'QC Test - Recent', 
-        'QC Test - Long Term'
-        ]
-
-    document = Document(
-        filepath + '''TMF-901B-00, Worksheet, Asanté™ HIV Rapid Recency®, 
-        Reader Results Images.docx''')
-    
-    #date stamp
-    head_table = document.tables[0]
-    head_table.cell(0,4).text = '''Completed with Data Processing Pipeline {} 
-            on {}.".format(version, date_comp)'''
-    
-    tbl = document.tables[1]
 
+# The hashed arguments of the two functions below are the PdsConfig fields
+# each step depends on, so changing e.g. the stats only reformats the table.
+@sl.cache_data(show_spinner=False, max_entries=32)
+def relevant_data(
+    digest: str, panel: tuple, conditions: tuple, reps_in_title: bool, 
+    other_data: bool, _read_in: pd.DataFrame, _config: pds.PdsConfig
+    ) -> pd.DataFrame:
+    return pds.relevant_data(_read_in, _config)
 
-    # progress bar
-    latest_iteration = sl.empty()
-    bar = sl.progress(0)
-    pc = 100/100/(len(panel)*rep_qty*clen)
-    pic_ct = 0
-    prog_bar_val = 0
 
-    skipped_tests = []
-    for i, _ in enumerate(time):
-        if test_type[i] in test_to_ignore:  
-            continue
-        else:
-            # create filename
-            d = str(date[i][2:])
-            t = str(time[i])
-
-            filename = d.replace('-', '') + '_' + t.replace(':', '_')
-
-            # Test No.
-            row_cells = tbl.add_row().cells
-            paragraph = row_cells[0].paragraphs[0]
-            run = paragraph.add_run(str(test_no[i]))
-
-            # Test Date
-            paragraph = row_cells[1].paragraphs[0]
-            run = paragraph.add_run(date[i])
-
-            # Test ID
-            paragraph = row_cells[2].paragraphs[0]
-            run = paragraph.add_run(test_ID[i])
-
-            # Line name
-            paragraph = row_cells[3].paragraphs[0]
-            run = paragraph.add_run()
-            run = paragraph.add_run(str(ver[i]))
-
-            # line value
-            paragraph = row_cells[4].paragraphs[0]
-            run = paragraph.add_run()
-            run = paragraph.add_run(str(round(ver_value[i], 3)))
-
-            if test_lines == 2:
-                # line 2 name
-                paragraph = row_cells[5].paragraphs[0]
-                run = paragraph.add_run()
-                run = paragraph.add_run(str(ltr[i]))
-
-                # line 2 value
-                paragraph = row_cells[6].paragraphs[0]
-                run = paragraph.add_run()
-                run = paragraph.add_run(str(round(ltr_value[i], 3)))
-
-
-            try:
-                # strip image
-                paragraph = row_cells[-3].paragraphs[0]
-                run = paragraph.add_run()
-                run.add_picture(
-                    filepath + 'strip_images/' + filename + '/Strip.jpg',
-                    width=3100000, height=660000
-                    )
-                a, b, c = row_cells[-3:]
-                a.merge(b)
-                a.merge(c)
-                # Update the progress bar with each iteration.
-                latest_iteration.text('Strip images moved: {} of {}'.format(
-                    pic_ct, expected_strip_ct)
-                    )
-                bar.progress(prog_bar_val)
-                prog_bar_val += pc
-                pic_ct += 1
-            except:
-                skipped_tests.append(test_ID[i])
-
-    bar.progress(100)
-
-    if len(skipped_tests) > 0:
-        sl.error(
-            "Could not find strip images for the following tests: {}.".format(
-                ', '.join(skipped_tests)))
-        sl.error('''Verify that Test Date is in YYYY-MM-DD format and that 
-                 Time Acquired is in HH:MM:SS 24hr format in data.csv.'''
-                 )
-
-    doc_path = filepath + '{} Completed TMF-910B.docx'.format(study_name)
-    document.save(doc_path)
-    sl.info('TMF-901B Exported.')
-
-
-    if pic_ct < expected_strip_ct:
-        sl.error(
-            '''{} strip images were expected based on user parameters but only
-            {} were identified. Check data.csv and strip_images folder for 
-            errors.'''.format(expected_strip_ct, pic_ct)
-            )
+@sl.cache_data(show_spinner=False, max_entries=32)
+def cached_replicate_stats(
+    digest: str, panel: tuple, conditions: tuple, reps_in_title: bool, 
+    other_data: bool, rep_qty: int, _data_matrix: pd.DataFrame, 
+    _config: pds.PdsConfig
+    ) -> tuple:
+    return pds.replicate_table(_data_matrix, _config)
 
            
 # main function calls
-def main():
-    
-    # file read in.
-    raw_data = read_in[[
-        'Test ID', 'Decision Message 1', 'Decision Message 2', 
-        'Decision Message 3', 'Position.1', 'Position.2'
-        ]].values
-    data_matrix = remove_nan(raw_data)
-
-
-    # formatting parameters.
-    lots_list = test_header.split(', ')
-    
-    if test_lines == 2:
-        lines = ['CTRL', 'VER', 'LTR']
-    elif test_lines == 1:
-        lines = ['CTRL', 'VER']
+def main(config: pds.PdsConfig):
 
     # function calls to handle data file.
     sl.spinner('Formatting Data...')
-    if other_data:
-        relevant_data = remove_irrelevant_testing(
-            data_matrix, panel, condition_list
-            )  
+    if incremental_data:
+        # only the rows added since the last run are read, and the TMF-901B
+        # is extended rather than rebuilt.
+        with run_metrics.stage('incremental update') as stage:
+            update = incremental.update_study(
+                data_path, config, date_comp, 'TMF-901B' in docs_to_export, 
+                version, progress.StreamlitProgress()
+                )
+            stage.count = len(update.new_tests)
+        result = update.result
+        headers, data_for_csv, warnings = result.headers, result.rows, update.warnings
+        if update.rebuilt:
+            sl.info('Processed all {} tests in data.csv.'.format(len(update.new_tests)))
+        else:
+            sl.info('Processed {} new tests.'.format(len(update.new_tests)))
+        sl.success('Exported formatted CSV.')
+
+    elif stream_data:
+        # data.csv is formatted chunk by chunk straight into the csv file.
+        with run_metrics.stage('streaming format'):
+            warnings = streaming.stream_format_data(data_path, config.csv_path, config)
+        with open(config.csv_path, newline='') as csvfile:
+            headers, *data_for_csv = csv.reader(csvfile)
+        result = None
+        sl.success('Exported formatted CSV.')
 
-        
-        headers, data_for_csv, test_objects = format_data(
-            relevant_data, rep_qty, lots_list, condition_list, lines, rep_stats
-            )
     else:
-        headers, data_for_csv, test_objects = format_data(
-            data_matrix, rep_qty, lots_list, condition_list, lines, rep_stats
+        params = (
+            export_digest, config.panel, config.conditions, 
+            config.reps_in_title, config.other_data
             )
+        # timed as one stage, since a cached result runs none of its steps.
+        with run_metrics.stage('relevant data') as stage:
+            data_matrix = relevant_data(*params, read_in, config)
+            stage.count = len(read_in)
+        with run_metrics.stage('replicate stats') as stage:
+            stats_table, incomplete = cached_replicate_stats(
+                *params, config.rep_qty, data_matrix, config
+                )
+            stage.count = len(data_matrix)
+        with run_metrics.stage('format_data', 'specimens') as stage:
+            result = pds.format_data(stats_table, incomplete, config)
+            stage.count = len(stats_table)
+        headers, data_for_csv, warnings = result.headers, result.rows, result.warnings
+    for warning in warnings:
+        sl.error(warning.message)
+    if result is not None and len(result.shifts) > 0:
+        sl.dataframe(result.shifts, hide_index=True)
     sl.info('Data formatted.')
     
 
     
 
     # writing to csv file
-    if 'Export Formatted CSV file' in docs_to_export:
+    if 'Export Formatted CSV file' in docs_to_export and not (stream_data or incremental_data):
         sl.spinner('Exporting data...')
-        output = filepath + '{}_Data_analysis.csv'.format(study_name)
-        with open(output, 'w', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(headers)
-            csvwriter.writerows(data_for_csv)
-            sl.success('Exported formatted CSV.')
+        with run_metrics.stage('csv export') as stage:
+            writers.write_rows(config.csv_path, headers, data_for_csv)
+            stage.count = len(data_for_csv)
+        sl.success('Exported formatted CSV.')
             
     if 'Download formatted data as txt' in docs_to_export:
-        csv_data = ''
-        csv_data += '\t'.join(headers)
-        csv_data += '\n'
-        for i in data_for_csv:
-            csv_data += '\t'.join([str(j) for j in i])
-            csv_data += '\n'
+        if download_format in writers.DELIMITERS:
+            buffer = writers.to_buffer(
+                writers.write_rows, headers, data_for_csv, download_format
+                )
+        elif result is not None:
+            buffer = writers.to_buffer(
+                writers.write_table, writers.prism_table(result.stats_table, config), 
+                download_format
+                )
+        else:
+            buffer = None
+            sl.error(
+                '''{} downloads are not available when data.csv is processed in
+                chunks.'''.format(download_format.upper())
+                )
         
-        sl.download_button(
-            'Download formatted data', csv_data, 
-            '{} Formatted data'.format(study_name))
+        if buffer is not None:
+            sl.download_button(
+                'Download formatted data', buffer, 
+                '{} Formatted data{}'.format(
+                    config.study_name, writers.EXTENSIONS[download_format]), 
+                writers.MIME_TYPES[download_format]
+                )
 
 
     # Generate TMF-901B Doc.
-    if 'TMF-901B' in docs_to_export:
-        generate_tmf901b(
-            read_in, filepath, panel, test_lines, rep_qty, 
-            condition_list, date_comp, version
-            )
+    if 'TMF-901B' in docs_to_export and not incremental_data:
+        # every test gets a row in the document, so it needs the full export.
+        export = ingest.read_export(data_path) if stream_data else read_in
+        # the document is built in the background; the jobs panel shows its
+        # progress and offers it for download once it is saved. split
+        # documents are offered together in a zip file.
+        if part_rows is None:
+            job = jobs.submit(
+                os.path.basename(config.doc_path), jobs.pds_tmf901b, export, config, 
+                date_comp, version
+                )
+        else:
+            job = jobs.submit(
+                os.path.basename(config.parts_path), jobs.pds_tmf901b_parts, export, 
+                config, date_comp, version, part_rows
+                )
+        if 'Export Formatted CSV file' in docs_to_export:
+            # the job's stages are added to the run report when it finishes.
+            job.report_path = config.report_path
+            job.started = run_metrics.started.isoformat(timespec='seconds')
+        sl.session_state.setdefault('tmf901b_jobs', []).append(job)
+        sl.info('TMF-901B job {} started.'.format(job.job_id))
 
 
     if "Balloons" in docs_to_export:
         sl.balloons()
 
 
-version = "v1.4"
+def show_diagnostics(config: pds.PdsConfig):
+    '''
+    Stage metrics of the run in an expander and, if the formatted CSV was
+    exported, a json run report next to it.
+    '''
+    if diagnostics:
+        with sl.expander('Diagnostics', expanded=True):
+            sl.dataframe(pd.DataFrame(run_metrics.table()), hide_index=True)
+            if run_metrics.profile_text is not None:
+                sl.code(run_metrics.profile_text)
+                sl.code('\n'.join(run_metrics.allocations))
+
+    if 'Export Formatted CSV file' in docs_to_export:
+        run_metrics.write_report(
+            config.report_path, study=config.study_name, version=version
+            )
+
+
+version = pds.VERSION
 
 
 
@@ -575,6 +210,10 @@ sl.sidebar.write("""
     
 pipeline = sl.sidebar.radio('Select pipeline: ', ['PDS', 'QC'])
 
+diagnostics = sl.sidebar.checkbox('Show run diagnostics')
+profile_run = sl.sidebar.checkbox('Profile the next run (slow)')
+run_metrics = metrics.RunMetrics(profile=profile_run)
+
 if pipeline == 'PDS':
     
     # User configurations in web app.
@@ -594,15 +233,37 @@ if pipeline == 'PDS':
          'TMF-901B',  'Balloons']
         )
     
+    stream_data = False
+    incremental_data = False
+    filepath = ''
     if 'Export Formatted CSV file' in docs_to_export:
         filepath = sl.text_input("Filepath: ", "")
         filepath += "/"
-        read_in = pd.read_csv(f"{filepath}data.csv", encoding="cp1252", engine="python")
+        data_path = f"{filepath}data.csv"
+        stream_data = sl.checkbox(
+            "Large data.csv: process in chunks without loading it into memory"
+            )
+        if not stream_data:
+            incremental_data = sl.checkbox(
+                "Growing data.csv: only process tests added since the last run"
+                )
+        if not (stream_data or incremental_data):
+            with open(data_path, 'rb') as f:
+                data_bytes = f.read()
+            export_digest = export_cache.file_digest(data_bytes)
+            with run_metrics.stage('ingest') as stage:
+                read_in = load_export(export_digest, data_bytes)
+                stage.count = len(read_in)
         
     if 'Download formatted data as txt' in docs_to_export:
+        download_format = sl.selectbox('Download format:', writers.FORMATS)
         data_readin = sl.file_uploader("Upload TestResults.csv")
         if data_readin != None:
-            read_in = pd.read_csv(data_readin)
+            data_bytes = data_readin.getvalue()
+            export_digest = export_cache.file_digest(data_bytes)
+            with run_metrics.stage('ingest') as stage:
+                read_in = load_export(export_digest, data_bytes)
+                stage.count = len(read_in)
     
     study_name = sl.text_input("Study name/number: ", "")
     
@@ -614,11 +275,11 @@ if pipeline == 'PDS':
     reps_in_title = True if reps_input == 'Yes' else False
     default_header = 'rep 1, rep 2, rep 3'
     
+    stat_key = replicate_stats.STAT_KEYS
     stats_input = sl.multiselect(
-        'Select statistics to run on replicates:', ['Mean', 'SD', '%CV', 'Median', 'MAD']
+        'Select statistics to run on replicates:', stat_key
         )
     
-    stat_key = ['Mean', 'SD', '%CV', 'Median', 'MAD']
     order = {v:i for i,v in enumerate(stat_key)}
     rep_stats = sorted(stats_input, key=lambda x: order[x])
     stats_len = len(rep_stats)
@@ -626,6 +287,12 @@ if pipeline == 'PDS':
     
     test_header = sl.text_input("Header for data table: ", default_header)
     
+    shift_k = sl.number_input(
+        "Also flag line positions more than this many MADs from the run median (0 = off):", 
+        min_value=0.0, value=0.0, step=0.5
+        )
+    shift_limits = replace(shifts.ASSAY_LIMITS[test], k=shift_k or None)
+    
     
     # Experimental condition selection
     multiple_conditions_input = sl.radio(
@@ -633,15 +300,22 @@ if pipeline == 'PDS':
         )
     
     if multiple_conditions_input == 'Search for my conditions':
-        multiple_conditions = True
-        condition_list = get_conditions(read_in)
-        conditions = sl.multiselect('Select your conditions: ', condition_list)
+        if stream_data or incremental_data:
+            condition_list = []
+            for chunk in ingest.iter_export(
+                    data_path, streaming.CHUNKSIZE, ['Test ID', 'Test Type']
+                    ):
+                condition_list += [
+                    c for c in pds.get_conditions(chunk) if c not in condition_list
+                    ]
+        else:
+            condition_list = cached_conditions(export_digest, read_in)
+        condition_list = sl.multiselect('Select your conditions: ', condition_list)
     elif multiple_conditions_input == 'Enter conditions':
-        multiple_conditions = True
         conditions = sl.text_input('Type conditions separated by comma+space:')
         condition_list = conditions.split(', ')
-    elif multiple_conditions_input == 'No experimental conditions':
-        multiple_conditions = False
+    elif multiple_conditions_input == 'I don\'t have experimental conditions':
+        condition_list = []
     
     other_data_input = sl.radio(
         "Is other data present in data set?", ['Yes', 'No']
@@ -653,11 +327,20 @@ if pipeline == 'PDS':
         specimens_tested = sl.text_input("Specimen tested or panel: ", "")
         panel = specimens_tested.split(', ')
     elif panel_select == 'Select from supported panels':
-        specimens_tested = sl.selectbox('Supported panels:', ['9169', '9170', 
-                                                              '9172', 'Prozone', 
-                                                              'Gilead', 'Gilead 2', 
-                                                              'RR', 'flex', '9172/9168 Hybrid'])
-        panel = specimen_bank.get_specimens(specimens_tested)
+        specimens_tested = sl.selectbox('Supported panels:', panels.names())
+        panel = panels.get_panel(specimens_tested).specimens
+    
+    # the TMF-901B of a large study can be split into several documents.
+    part_rows = None
+    if 'TMF-901B' in docs_to_export and not incremental_data:
+        split_input = sl.radio(
+            'TMF-901B output', ['One document', 'Split by pages', 'Split by rows']
+            )
+        if split_input == 'Split by pages':
+            part_pages = sl.number_input('Pages per document:', min_value=1, value=50, step=1)
+            part_rows = part_pages * pds.PAGE_ROWS
+        elif split_input == 'Split by rows':
+            part_rows = sl.number_input('Rows per document:', min_value=1, value=500, step=50)
     
     
     sl.write("Last updated 11 NOV 2021.")
@@ -669,7 +352,18 @@ if pipeline == 'PDS':
     
     
     if done == True:
-        main()
+        config = pds.PdsConfig(
+            study_name=study_name, panel=panel, rep_qty=rep_qty, 
+            test_lines=test_lines, reps_in_title=reps_in_title, 
+            conditions=condition_list, other_data=other_data, 
+            lots=test_header.split(', '), rep_stats=rep_stats, 
+            filepath=filepath, shift_limits=shift_limits
+            )
+        with run_metrics.capture():
+            main(config)
+        show_diagnostics(config)
+
+    jobs.show_jobs('tmf901b_jobs')
         
 elif pipeline == 'QC':
     qcmain.main()
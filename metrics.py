@@ -0,0 +1,216 @@
+'''
+Per-stage metrics of a pipeline run: wall time, the number of rows (or
+images) handled, throughput and peak memory, kept as StageMetric records
+and written as a json run report.
+
+Pipeline steps take a RunMetrics like they take a Progress, and time their
+stages with it:
+
+    with metrics.stage('format_data', 'specimens') as stage:
+        result = format_data(...)
+        stage.count = len(stats_table)
+
+A stage's peak memory is the most memory the process used during the
+stage on top of what it used when the stage started. It is read from the
+resident size, whose peak Linux lets a process reset at the start of each
+stage, and is None where that is not possible. The resident size is shared
+by every thread, so stages of other sessions of the app that run at the
+same time add to it. Stages can be nested: the peak of an enclosing stage
+is kept when a stage inside it resets the peak.
+
+With profile set, a run inside RunMetrics.capture() is also profiled with
+cProfile and tracemalloc, and peak memory is then the memory traced by
+tracemalloc instead, which only counts the run's own allocations.
+Profiling slows the run down several times, so it is meant for a single
+run. cProfile only sees the thread that started the capture.
+'''
+import contextlib
+import cProfile
+from dataclasses import asdict, dataclass
+from datetime import datetime
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+
+# Linux's resident size of the process and its peak, and the file that
+# resets the peak when 5 is written to it.
+PROC_STATUS = '/proc/self/status'
+CLEAR_REFS = '/proc/self/clear_refs'
+
+# functions and allocation sites listed in a profiled run's report.
+PROFILE_LINES = 30
+ALLOCATION_LINES = 15
+
+
+@dataclass
+class StageMetric:
+    '''
+    Metrics of one stage. count is the number of units handled, None if the
+    stage does not count anything, and peak_mb is None unless the run is
+    profiled.
+    '''
+    stage: str
+    seconds: float = 0.0
+    count: int = None
+    unit: str = 'rows'
+    peak_mb: float = None
+
+    @property
+    def throughput(self) -> float:
+        if self.count is None or self.seconds <= 0:
+            return None
+        return self.count / self.seconds
+
+    def as_dict(self) -> dict:
+        record = asdict(self)
+        record['throughput'] = self.throughput
+        return record
+
+
+def memory() -> tuple:
+    '''
+    Memory in use by the process and its peak since the last reset_peak, in
+    bytes, or None if it cannot be read.
+    '''
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()
+
+    sizes = {}
+    try:
+        with open(PROC_STATUS) as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    # in kB.
+                    sizes[line[:5]] = int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    if len(sizes) < 2:
+        return None
+    return sizes['VmRSS'], sizes['VmHWM']
+
+
+def reset_peak():
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        return
+    try:
+        with open(CLEAR_REFS, 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class RunMetrics:
+    '''
+    Stage metrics of one run, in the order the stages finished.
+    '''
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self.stages = []
+        self.started = datetime.now()
+        self.profile_text = None
+        self.allocations = None
+        # the stages being timed, with the memory in use when they started.
+        self.open = []
+
+    def checkpoint(self):
+        '''
+        Raise the peak memory of the open stages to the peak since the last
+        reset, before it is reset again or the innermost stage ends.
+        '''
+        usage = memory()
+        if usage is None:
+            return
+        for record, baseline in self.open:
+            if baseline is None:
+                continue
+            peak = max(usage[1] - baseline, 0) / 2 ** 20
+            record.peak_mb = peak if record.peak_mb is None else max(record.peak_mb, peak)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, unit: str = 'rows'):
+        record = StageMetric(name, unit=unit)
+        self.checkpoint()
+        reset_peak()
+        usage = memory()
+        self.open.append((record, None if usage is None else usage[0]))
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            self.checkpoint()
+            self.open.pop()
+            self.stages.append(record)
+
+    @contextlib.contextmanager
+    def capture(self):
+        '''
+        Profile the run inside the block if profile is set.
+        '''
+        if not self.profile:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+            text = io.StringIO()
+            stats = pstats.Stats(profiler, stream=text)
+            stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+            self.profile_text = text.getvalue()
+            self.allocations = [
+                str(s) for s in snapshot.statistics('lineno')[:ALLOCATION_LINES]
+                ]
+
+    def table(self) -> list:
+        return [s.as_dict() for s in self.stages]
+
+    def report(self, **info) -> dict:
+        '''
+        The run report: info, such as the study name, the stage records and
+        the profile of a profiled run.
+        '''
+        report = dict(info)
+        report['started'] = self.started.isoformat(timespec='seconds')
+        report['seconds'] = sum(s.seconds for s in self.stages)
+        report['stages'] = self.table()
+        if self.profile_text is not None:
+            report['profile'] = self.profile_text.splitlines()
+            report['allocations'] = self.allocations
+        return report
+
+    def write_report(self, path: str, **info):
+        with open(path, 'w') as f:
+            json.dump(self.report(**info), f, indent=2)
+
+
+def add_stages(path: str, stages: list, started: str):
+    '''
+    Add the stage records of a step that finished after its run's report
+    was written, such as a TMF-901B built in the background, to the report
+    at path. The report is left alone if it is missing or was replaced by
+    the report of a run other than the one started at started.
+    '''
+    try:
+        with open(path) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return
+    if report.get('started') != started:
+        return
+
+    report['stages'] += stages
+    report['seconds'] = sum(s['seconds'] for s in report['stages'])
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
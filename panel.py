@@ -1,6 +1,6 @@
 
-def get_status(member):
-    panel = {
+# expected recency status of the 9169 panel members.
+STATUSES = {
         '9169-01': 'LT', '9169-02': 'Negative', '9169-03': 'LT', 
              '9169-04': 'LT', '9169-05': 'LT', '9169-06': 'Recent', 
              '9169-07': 'LT', '9169-08': 'LT', '9169-09': 'LT', 
@@ -26,5 +26,7 @@ def get_status(member):
              '9169-69': 'LT', '9169-70': 'Recent', '9169-71': 'Recent', 
              '9169-72': 'Recent', '9169-73': 'LT'
              }
-    
-    return panel[member]
\ No newline at end of file
+
+
+def get_status(member):
+    return STATUSES[member]
\ No newline at end of file
@@ -0,0 +1,132 @@
+'''
+Registry of the supported panels, shared by the PDS and QC pipelines. The
+registry is built once per process from the built-in tables in
+specimen_bank.py and panel.py, plus the panels in the file named by the
+PDS_PANELS environment variable, if set, so new panels can be added without
+editing the code. A panel in the file replaces a built-in panel of the same
+name.
+
+The file is either json:
+
+    {
+        "9169": ["9169-01", "9169-02", ...],
+        "New panel": {
+            "specimens": ["np-01", "np-02", ...],
+            "statuses": {"np-01": "LT", "np-02": "Recent", ...}
+        }
+    }
+
+or a csv with a 'Panel' and 'Specimen' column, and optionally a 'Status'
+column, with the specimens of each panel in output order.
+'''
+from dataclasses import dataclass, field
+from functools import lru_cache
+import json
+import os
+
+import pandas as pd
+
+import panel
+import specimen_bank
+
+
+PANELS_PATH = os.environ.get('PDS_PANELS', '')
+
+# old names of panels that have been renamed.
+ALIASES = {'Gilead': 'Gilead 1'}
+
+
+@dataclass(frozen=True)
+class Panel:
+    '''
+    A supported panel. specimens are in output order, members is the same
+    specimens as a set for membership tests and statuses maps specimens to
+    their expected status, for the panels that have one.
+    '''
+    name: str
+    specimens: tuple
+    members: frozenset = field(init=False, repr=False)
+    statuses: dict = field(default_factory=dict, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'specimens', tuple(self.specimens))
+        object.__setattr__(self, 'members', frozenset(self.specimens))
+        object.__setattr__(self, 'statuses', dict(self.statuses))
+
+    def __contains__(self, specimen: str) -> bool:
+        return specimen in self.members
+
+    def status(self, specimen: str) -> str:
+        '''
+        Expected status of a specimen, None if the panel has none.
+        '''
+        return self.statuses.get(specimen)
+
+
+def builtin_panels() -> dict:
+    statuses = {'9169': panel.STATUSES}
+    return {
+        name: Panel(name, specimens, statuses.get(name, {}))
+        for name, specimens in specimen_bank.SPECIMEN_BANK.items()
+        }
+
+
+def read_panels(path: str) -> dict:
+    '''
+    Panels in a json or csv panel file.
+    '''
+    if path.lower().endswith('.json'):
+        with open(path) as f:
+            table = json.load(f)
+        panels = {}
+        for name, value in table.items():
+            if isinstance(value, dict):
+                panels[name] = Panel(name, value['specimens'], value.get('statuses', {}))
+            else:
+                panels[name] = Panel(name, value)
+        return panels
+
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = {'Panel', 'Specimen'} - set(table.columns)
+    if missing:
+        raise ValueError(
+            '{} is missing the column(s): {}'.format(path, ', '.join(sorted(missing)))
+            )
+    panels = {}
+    for name, rows in table.groupby('Panel', sort=False):
+        statuses = {}
+        if 'Status' in rows:
+            statuses = dict(rows.loc[rows['Status'] != '', ['Specimen', 'Status']].to_numpy())
+        panels[name] = Panel(name, rows['Specimen'].tolist(), statuses)
+    return panels
+
+
+@lru_cache(maxsize=None)
+def load_registry(path: str = PANELS_PATH) -> dict:
+    '''
+    Built-in panels updated with the panels in the file at path, if any, by
+    name in the order they were defined. Loaded once per path; treat the
+    result as read only.
+    '''
+    panels = builtin_panels()
+    if path:
+        panels.update(read_panels(path))
+    return panels
+
+
+def names(path: str = PANELS_PATH) -> list:
+    return list(load_registry(path))
+
+
+def get_panel(name: str, path: str = PANELS_PATH) -> Panel:
+    '''
+    Registered panel by name. Raises KeyError for an unknown panel.
+    '''
+    registry = load_registry(path)
+    name = name if name in registry else ALIASES.get(name, name)
+    try:
+        return registry[name]
+    except KeyError:
+        raise KeyError('Unknown panel: {}. Supported panels are {}'.format(
+            name, ', '.join(registry)
+            )) from None
@@ -0,0 +1,762 @@
+'''
+PDS data processing without the web app. Every function takes its settings
+as arguments or as a PdsConfig and returns its problems as PipelineWarning
+records instead of showing them, so studies can be processed from the
+Streamlit app, from batch.py, or several at once in threads.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from dataclasses import dataclass
+import io
+from itertools import repeat
+import os
+import threading
+import zipfile
+
+import numpy as np
+import pandas as pd
+from docx import Document
+
+import export_cache
+import ingest
+from metrics import RunMetrics
+from progress import Progress
+import qc_stats
+import replicate_stats
+import shifts
+import strip_images
+import test_ids
+
+
+VERSION = "v1.4"
+
+TEMPLATE_NAME = (
+    'TMF-901B-00, Worksheet, Asanté™ HIV Rapid Recency®, '
+    'Reader Results Images.docx'
+    )
+
+# Test types that are not part of a study and are left out of the TMF-901B.
+TESTS_TO_IGNORE = [
+    'Instrument Check, Visual, Red/Gold', 'ROF QC Test - Negative',
+    'ROF QC Test - Positive', 'QC Test - Negative', 'QC Test - Recent',
+    'QC Test - Long Term'
+    ]
+
+# below this many rows, starting worker processes takes longer than the
+# replicate stats themselves.
+PARALLEL_MIN_ROWS = 200000
+
+# parsed blank TMF-901Bs kept by read_template, by the digest of the file.
+TEMPLATE_CACHE_SIZE = 8
+_templates = {}
+_template_lock = threading.Lock()
+
+# rows of strip images that fit on a page of the TMF-901B, about, used to
+# split it into parts by pages.
+PAGE_ROWS = 10
+
+# PipelineWarning kinds.
+INCOMPLETE = 'incomplete'
+LTR_SHIFT = 'ltr shift'
+VER_SHIFT = 'ver shift'
+MISSING_IMAGES = 'missing images'
+AMBIGUOUS_IMAGES = 'ambiguous images'
+STRIP_COUNT = 'strip count'
+RETESTS = 'retests'
+UNMATCHED_RETESTS = 'unmatched retests'
+
+
+@dataclass(frozen=True)
+class PipelineWarning:
+    '''
+    A problem found while processing a study. kind is one of the kinds above,
+    items are the samples or tests concerned and message is the text shown
+    to the user.
+    '''
+    kind: str
+    message: str
+    items: tuple = ()
+
+
+@dataclass(frozen=True)
+class PdsConfig:
+    '''
+    Settings for processing a PDS study. filepath is the folder holding
+    data.csv, the strip_images folder and the blank TMF-901B, and where
+    outputs are saved. There are experimental conditions if conditions is
+    not empty.
+    '''
+    study_name: str
+    panel: tuple
+    rep_qty: int
+    test_lines: int = 2
+    reps_in_title: bool = True
+    conditions: tuple = ()
+    other_data: bool = True
+    lots: tuple = ('rep 1', 'rep 2', 'rep 3')
+    rep_stats: tuple = ()
+    filepath: str = ''
+    shift_limits: shifts.ShiftLimits = None
+
+    def __post_init__(self):
+        if self.shift_limits is None:
+            object.__setattr__(self, 'shift_limits', shifts.ASSAY_LIMITS[self.assay])
+
+        # store lists as tuples so configs can be hashed and shared.
+        order = {v: i for i, v in enumerate(replicate_stats.STAT_KEYS)}
+        object.__setattr__(self, 'panel', tuple(self.panel))
+        object.__setattr__(self, 'conditions', tuple(self.conditions))
+        object.__setattr__(self, 'lots', tuple(self.lots))
+        object.__setattr__(
+            self, 'rep_stats', tuple(sorted(self.rep_stats, key=lambda x: order[x]))
+            )
+
+    @property
+    def assay(self) -> str:
+        return 'Rapid Recency' if self.test_lines == 2 else 'Oral Fluid'
+
+    @property
+    def multiple_conditions(self) -> bool:
+        return len(self.conditions) > 0
+
+    @property
+    def lines(self) -> list:
+        return get_lines(self.test_lines)
+
+    @property
+    def csv_path(self) -> str:
+        return self.filepath + '{}_Data_analysis.csv'.format(self.study_name)
+
+    @property
+    def doc_path(self) -> str:
+        return self.filepath + '{} Completed TMF-910B.docx'.format(self.study_name)
+
+    @property
+    def parts_path(self) -> str:
+        return self.filepath + '{} Completed TMF-910B.zip'.format(self.study_name)
+
+    def part_name(self, part: int, parts: int) -> str:
+        '''
+        Name of a part of a TMF-901B split into parts, in its zip file.
+        '''
+        return '{} Completed TMF-910B part {:0{}d} of {}.docx'.format(
+            self.study_name, part, len(str(parts)), parts
+            )
+
+    @property
+    def report_path(self) -> str:
+        return self.filepath + '{}_run_report.json'.format(self.study_name)
+
+
+@dataclass
+class PdsResult:
+    '''
+    Formatted data table of a study, the replicate stats table it was built
+    from (with the flagged strips of each specimen joined to it), the
+    problems found and the flag table of strips with a line position shift.
+    '''
+    headers: list
+    rows: list
+    stats_table: pd.DataFrame
+    warnings: list
+    shifts: pd.DataFrame = None
+
+
+def get_conditions(read_in: pd.DataFrame) -> list:
+    '''
+    Parse test ID's from imported csv file for experimental conditions.
+    Conditions must follow naming convention in documentation.
+    '''
+    tests = read_in.loc[read_in['Test Type'] == 'SediaBio HIV - Rapid Recency - v8', 'Test ID']
+    return list(test_ids.condition_candidates(tests).dropna().unique())
+
+
+def remove_nan(data_matrix: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Removes any NA values from the data.
+    '''
+    return data_matrix[data_matrix['Decision Message 1'].notna()]
+
+
+def remove_irrelevant_testing(
+    data_matrix: pd.DataFrame, panel: list, condition_list: list,
+    multiple_conditions: bool, reps_in_title: bool, keys: pd.DataFrame = None
+    ) -> pd.Series:
+    '''
+    Uses the panel tested and list of experimental conditions to remove irrelevant
+    data from the data matrix. This was implemented because data from multiple
+    users can be pooled in the exported data by the test strip reader.
+
+    Each test ID is split into condition, sample and replicate once, unless keys
+    holds them already, and checked against sets of the panel members and
+    conditions. Returns a boolean mask of the rows to keep.
+
+    This function can be bypassed if desired by setting the "is there other data
+    present" to no in the network GUI.
+    '''
+    return replicate_stats.relevant_mask(
+        data_matrix, panel, condition_list, multiple_conditions, reps_in_title,
+        keys
+        )
+
+
+def get_lines(test_lines: int) -> list:
+    '''
+    Lines on the strip for a 2 line (Rapid Recency) or 1 line (Oral Fluid)
+    assay.
+    '''
+    if test_lines == 2:
+        return ['CTRL', 'VER', 'LTR']
+    return ['CTRL', 'VER']
+
+
+def relevant_data(
+    read_in: pd.DataFrame, config: PdsConfig, metrics: RunMetrics = None
+    ) -> pd.DataFrame:
+    '''
+    Data with NA values and, if other data is present, irrelevant testing
+    removed. The Test ID's are split once, into the 'Condition', 'Specimen'
+    and 'Replicate' columns added to the data, which the later stages read
+    instead of splitting them again.
+    '''
+    if metrics is None:
+        metrics = RunMetrics()
+
+    with metrics.stage('remove_nan') as stage:
+        data_matrix = remove_nan(read_in[replicate_stats.DATA_COLUMNS])
+        stage.count = len(read_in)
+    with metrics.stage('parse test ids') as stage:
+        keys = test_ids.parse_pds_ids(
+            data_matrix['Test ID'], config.conditions, config.reps_in_title
+            )
+        data_matrix = pd.concat([data_matrix, keys], axis=1)
+        stage.count = len(data_matrix)
+    if config.other_data:
+        with metrics.stage('remove_irrelevant_testing') as stage:
+            stage.count = len(data_matrix)
+            data_matrix = data_matrix[remove_irrelevant_testing(
+                data_matrix, config.panel, config.conditions,
+                config.multiple_conditions, config.reps_in_title,
+                data_matrix[replicate_stats.KEY_COLUMNS]
+                )]
+    return data_matrix
+
+
+def condition_stats(data: pd.DataFrame, keys: pd.DataFrame, config: PdsConfig) -> tuple:
+    '''
+    Replicate stats of the rows of a run of conditions. Runs in a worker
+    process.
+    '''
+    return replicate_stats.compute_replicate_stats(
+        data, config.rep_qty, config.conditions, True, config.reps_in_title, keys
+        )
+
+
+def replicate_table(
+    data_matrix: pd.DataFrame, config: PdsConfig, workers: int = 1,
+    min_rows: int = PARALLEL_MIN_ROWS, keys: pd.DataFrame = None
+    ) -> tuple:
+    '''
+    Replicate stats of every specimen and the specimens that could not be
+    grouped. See replicate_stats.compute_replicate_stats. keys are the split
+    Test ID's of data_matrix, by default the key columns relevant_data adds
+    to it.
+
+    With more than one worker (None for one per core), a study with several
+    conditions and at least min_rows rows is partitioned by condition once,
+    the conditions are split into one consecutive run per worker and the
+    stats of each run are computed in a separate process. The tables are
+    merged back in condition order, so the result is the same as computing
+    the stats in one pass.
+    '''
+    if keys is None and set(replicate_stats.KEY_COLUMNS) <= set(data_matrix):
+        keys = data_matrix[replicate_stats.KEY_COLUMNS]
+    if keys is None:
+        keys = test_ids.parse_pds_ids(
+            data_matrix['Test ID'], config.conditions, config.reps_in_title
+            )
+
+    workers = os.cpu_count() if workers is None else workers
+    conditions = list(dict.fromkeys(config.conditions))
+    if workers < 2 or len(conditions) < 2 or len(data_matrix) < min_rows:
+        return replicate_stats.compute_replicate_stats(
+            data_matrix, config.rep_qty, config.conditions,
+            config.multiple_conditions, config.reps_in_title, keys
+            )
+
+    partitions = keys.groupby('Condition', sort=False).indices
+    conditions = [c for c in conditions if c in partitions]
+
+    # one task per worker; a task per condition spends longer pickling than
+    # computing.
+    runs = [r for r in np.array_split(np.arange(len(conditions)), workers) if len(r) > 0]
+    rows = [
+        np.sort(np.concatenate([partitions[conditions[i]] for i in run]))
+        for run in runs
+        ]
+    with ProcessPoolExecutor(max_workers=len(rows)) as executor:
+        parts = list(executor.map(
+            condition_stats,
+            [data_matrix.iloc[r] for r in rows], [keys.iloc[r] for r in rows],
+            repeat(config, len(rows))
+            ))
+    table = pd.concat([part[0] for part in parts], ignore_index=True)
+
+    # list incomplete specimens in order of first appearance, like one pass does.
+    first = keys.drop_duplicates(['Condition', 'Specimen'])
+    seen = {
+        ' '.join(i for i in pair if i): n
+        for n, pair in enumerate(zip(first['Condition'], first['Specimen']))
+        }
+    incomplete = sorted((i for part in parts for i in part[1]), key=seen.get)
+    return table, incomplete
+
+
+def format_data(
+    stats_table: pd.DataFrame, incomplete: list, config: PdsConfig
+    ) -> PdsResult:
+    '''
+    Returns a formatted table for verification built from the replicate stats
+    of every specimen run, along with warnings for specimens that could not
+    be formatted or have a line position shift. The QC stats in rep_stats are
+    added to the stats table first, see qc_stats, and the flagged strips of
+    each line, see shifts.join_flags.
+    '''
+    headers = replicate_stats.format_headers(
+        config.lines, config.lots, config.rep_stats, config.multiple_conditions
+        )
+    stats_table = qc_stats.add_qc_stats(
+        stats_table, config.rep_qty, config.lines, config.rep_stats
+        )
+
+    # Check for color creep
+    flags = shifts.detect_shifts(stats_table, config.rep_qty, config.shift_limits)
+    stats_table = shifts.join_flags(stats_table, flags, config.lines)
+
+    data_for_csv = replicate_stats.format_rows(
+        stats_table, config.rep_qty, config.lines, config.rep_stats,
+        config.conditions, config.multiple_conditions
+        )
+
+    warnings = formatting_warnings(incomplete, flags)
+
+    return PdsResult(headers, data_for_csv, stats_table, warnings, flags)
+
+
+def process(
+    read_in: pd.DataFrame, config: PdsConfig, workers: int = 1,
+    metrics: RunMetrics = None
+    ) -> PdsResult:
+    '''
+    Filter, run replicate stats on and format a study's export. See
+    replicate_table for workers.
+    '''
+    if metrics is None:
+        metrics = RunMetrics()
+
+    data_matrix = relevant_data(read_in, config, metrics)
+    with metrics.stage('replicate stats') as stage:
+        stats_table, incomplete = replicate_table(
+            data_matrix, config, workers,
+            keys=data_matrix[replicate_stats.KEY_COLUMNS]
+            )
+        stage.count = len(data_matrix)
+    with metrics.stage('format_data', 'specimens') as stage:
+        result = format_data(stats_table, incomplete, config)
+        stage.count = len(stats_table)
+    return result
+
+
+def formatting_warnings(incomplete: list, flags: pd.DataFrame) -> list:
+    '''
+    Warnings for specimens that could not be formatted and strips in the
+    flag table of line position shifts.
+    '''
+    cc_message = shifts.flag_labels(flags, 'LTR')
+    ct_message = shifts.flag_labels(flags, 'VER')
+
+    warnings = []
+    for name in incomplete:
+        warnings.append(PipelineWarning(
+                INCOMPLETE,
+                '''Could not format data. A replicate may be duplicated
+                    or missing for {}.'''.format(name),
+                (name,)
+                ))
+
+    if len(cc_message) > 0:
+        warnings.append(PipelineWarning(
+            LTR_SHIFT,
+            '''Significant position shift for LTR line detected in the
+            following samples: {}. Color creep or covertape may have been
+            mistaken for the LTR line.'''.format(', '.join(cc_message)),
+            tuple(cc_message)
+            ))
+    if len(ct_message) > 0:
+        warnings.append(PipelineWarning(
+            VER_SHIFT,
+            '''Significant position shift for VER line detected in the
+            following samples: {}. Covertape is likely in strip image.
+            '''.format(', '.join(ct_message)),
+            tuple(ct_message)
+            ))
+
+    return warnings
+
+
+# generate test strip image doc from date and time of test
+def stamp_tmf901b(
+        document: Document, version: str, date_comp: str, part: int = None,
+        parts: int = None
+        ):
+    '''
+    Write the pipeline version and date into the TMF-901B header table, and
+    the part number for a TMF-901B split into parts.
+    '''
+    head_table = document.tables[0]
+    stamp = 'Completed with Data Processing Pipeline {} on {}.'.format(
+        version, date_comp
+        )
+    if part is not None:
+        stamp += ' Part {} of {}.'.format(part, parts)
+    head_table.cell(0,4).text = stamp
+
+
+def add_tmf901b_rows(
+        document: Document, df: pd.DataFrame, config: PdsConfig,
+        progress: Progress, expected_strip_ct: int = None,
+        match: pd.DataFrame = None
+        ) -> tuple:
+    '''
+    Append a row and strip image to the TMF-901B results table for every
+    test in df. Tests are matched to the images in the strip_images folder
+    before the table is built, unless their match from
+    strip_images.match_strip_images is passed, in order of the tests left
+    after TESTS_TO_IGNORE. Returns the number of strip images added and
+    warnings for the tests whose image is missing or ambiguous.
+    '''
+    test_lines = config.test_lines
+
+    time = df['Time Acquired'].values
+    date = df['Test Date'].values
+    test_no = df['Test Number'].values
+    test_ID = df['Test ID'].values
+    ver = df['Decision Title 2'].values
+    ver_value = df['Decision Message 2'].values
+
+    if test_lines == 2:
+        ltr = df['Decision Title 3'].values
+        ltr_value = df['Decision Message 3'].values
+    test_type = df['Test Type'].values
+
+    tbl = document.tables[1]
+
+    pic_ct = 0
+
+    # match tests to images, then read and downsize every image up front
+    # before the table is built.
+    rows = [i for i, _ in enumerate(time) if test_type[i] not in TESTS_TO_IGNORE]
+    if expected_strip_ct is None:
+        expected_strip_ct = len(rows)
+    if match is None:
+        match = match_strip_images(df.iloc[rows], config)
+
+    images = strip_images.load_strip_images(
+        match['Path'].tolist(), cache=strip_images.ThumbnailCache()
+        )
+
+    skipped_tests = []
+    ambiguous_tests = []
+    for i, image, found in zip(rows, images, match['Match']):
+        # Test No.
+        row_cells = tbl.add_row().cells
+        paragraph = row_cells[0].paragraphs[0]
+        run = paragraph.add_run(str(test_no[i]))
+
+        # Test Date
+        paragraph = row_cells[1].paragraphs[0]
+        run = paragraph.add_run(date[i])
+
+        # Test ID
+        paragraph = row_cells[2].paragraphs[0]
+        run = paragraph.add_run(test_ID[i])
+
+        # Line name
+        paragraph = row_cells[3].paragraphs[0]
+        run = paragraph.add_run()
+        run = paragraph.add_run(str(ver[i]))
+
+        # line value
+        paragraph = row_cells[4].paragraphs[0]
+        run = paragraph.add_run()
+        run = paragraph.add_run(str(round(ver_value[i], 3)))
+
+        if test_lines == 2:
+            # line 2 name
+            paragraph = row_cells[5].paragraphs[0]
+            run = paragraph.add_run()
+            run = paragraph.add_run(str(ltr[i]))
+
+            # line 2 value
+            paragraph = row_cells[6].paragraphs[0]
+            run = paragraph.add_run()
+            run = paragraph.add_run(str(round(ltr_value[i], 3)))
+
+        if found == strip_images.AMBIGUOUS:
+            ambiguous_tests.append(test_ID[i])
+            continue
+        if image is None:
+            skipped_tests.append(test_ID[i])
+            continue
+
+        # strip image
+        paragraph = row_cells[-3].paragraphs[0]
+        run = paragraph.add_run()
+        run.add_picture(
+            image, width=strip_images.STRIP_WIDTH,
+            height=strip_images.STRIP_HEIGHT
+            )
+        a, b, c = row_cells[-3:]
+        a.merge(b)
+        a.merge(c)
+
+        pic_ct += 1
+        progress.update('Strip images moved', pic_ct, expected_strip_ct)
+
+    return pic_ct, missing_images_warnings(skipped_tests, ambiguous_tests)
+
+
+def match_strip_images(df: pd.DataFrame, config: PdsConfig) -> pd.DataFrame:
+    '''
+    Match the tests in df to the images in the study's strip_images folder.
+    See strip_images.match_strip_images.
+    '''
+    if 'Acquired' in df:
+        acquired = df['Acquired']
+    else:
+        acquired = ingest.parse_acquired(df['Test Date'], df['Time Acquired'])
+    index = strip_images.index_strip_images(config.filepath + 'strip_images')
+    return strip_images.match_strip_images(acquired, index)
+
+
+def missing_images_warnings(skipped_tests: list, ambiguous_tests: list = ()) -> list:
+    '''
+    Warnings listing the tests left without a strip image, because none was
+    found or because it could not be told which of several tests it is of.
+    '''
+    warnings = []
+    if len(skipped_tests) > 0:
+        warnings.append(PipelineWarning(
+            MISSING_IMAGES,
+            "Could not find strip images for the following tests: {}. "
+            "Verify that Test Date is in YYYY-MM-DD format and that Time "
+            "Acquired is in HH:MM:SS 24hr format in data.csv.".format(
+                ', '.join(skipped_tests)),
+            tuple(skipped_tests)
+            ))
+    if len(ambiguous_tests) > 0:
+        warnings.append(PipelineWarning(
+            AMBIGUOUS_IMAGES,
+            "The strip images of the following tests could not be told apart "
+            "since they were acquired within {} s of each other: {}. Check "
+            "their Time Acquired in data.csv and the strip_images folder.".format(
+                int(strip_images.MATCH_TOLERANCE.total_seconds()),
+                ', '.join(ambiguous_tests)),
+            tuple(ambiguous_tests)
+            ))
+    return warnings
+
+
+def expected_strips(config: PdsConfig) -> int:
+    clen = len(config.conditions) if len(config.conditions) > 0 else 1
+    return len(config.panel) * config.rep_qty * clen
+
+
+def strip_count_warnings(expected_strip_ct: int, pic_ct: int) -> list:
+    if pic_ct >= expected_strip_ct:
+        return []
+    return [PipelineWarning(
+        STRIP_COUNT,
+        '''{} strip images were expected based on user parameters but only
+        {} were identified. Check data.csv and strip_images folder for
+        errors.'''.format(expected_strip_ct, pic_ct)
+        )]
+
+
+def read_template(source) -> Document:
+    '''
+    A copy of the blank TMF-901B in source, a path, the file's bytes or a
+    file-like object such as a Streamlit upload. Each template is parsed once
+    per process and deep-copied for every document, so documents built at the
+    same time never share one.
+    '''
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            data = f.read()
+    elif isinstance(source, bytes):
+        data = source
+    else:
+        data = source.getvalue()
+
+    digest = export_cache.file_digest(data)
+    with _template_lock:
+        template = _templates.get(digest)
+        if template is None:
+            template = Document(io.BytesIO(data))
+            _templates[digest] = template
+            # the oldest template is dropped first.
+            if len(_templates) > TEMPLATE_CACHE_SIZE:
+                del _templates[next(iter(_templates))]
+    return copy.deepcopy(template)
+
+
+def document_bytes(document: Document) -> bytes:
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def build_tmf901b(
+        df: pd.DataFrame, config: PdsConfig, date_comp: str,
+        version: str = VERSION, progress: Progress = None,
+        metrics: RunMetrics = None
+        ) -> tuple:
+    '''
+    Fill a copy of the blank TMF-901B in config.filepath with a row and strip
+    image for every test in the export. Returns the document and a list of
+    warnings.
+    '''
+    if progress is None:
+        progress = Progress()
+    if metrics is None:
+        metrics = RunMetrics()
+
+    expected_strip_ct = expected_strips(config)
+
+    document = read_template(config.filepath + TEMPLATE_NAME)
+    stamp_tmf901b(document, version, date_comp)
+
+    with metrics.stage('tmf901b images', 'images') as stage:
+        pic_ct, warnings = add_tmf901b_rows(
+            document, df, config, progress, expected_strip_ct
+            )
+        stage.count = pic_ct
+
+    return document, warnings + strip_count_warnings(expected_strip_ct, pic_ct)
+
+
+def generate_tmf901b(
+        df: pd.DataFrame, config: PdsConfig, date_comp: str,
+        version: str = VERSION, progress: Progress = None,
+        metrics: RunMetrics = None
+        ) -> tuple:
+    '''
+    build_tmf901b, saving the document next to the blank TMF-901B. Returns
+    the path of the saved document and a list of warnings.
+    '''
+    if metrics is None:
+        metrics = RunMetrics()
+
+    document, warnings = build_tmf901b(
+        df, config, date_comp, version, progress, metrics
+        )
+    with metrics.stage('tmf901b save'):
+        document.save(config.doc_path)
+
+    return config.doc_path, warnings
+
+
+def tmf901b_part(
+        df: pd.DataFrame, match: pd.DataFrame, config: PdsConfig,
+        date_comp: str, version: str, part: int, parts: int
+        ) -> tuple:
+    '''
+    Build one part of a TMF-901B split into parts, from the tests in df and
+    their strip image match. Returns the docx as bytes, the number of strip
+    images in it and its warnings.
+    '''
+    document = read_template(config.filepath + TEMPLATE_NAME)
+    stamp_tmf901b(document, version, date_comp, part, parts)
+    pic_ct, warnings = add_tmf901b_rows(
+        document, df, config, Progress(), match=match
+        )
+    return document_bytes(document), pic_ct, warnings
+
+
+def write_tmf901b_parts(
+        df: pd.DataFrame, config: PdsConfig, date_comp: str, output,
+        part_rows: int, version: str = VERSION, progress: Progress = None,
+        metrics: RunMetrics = None, workers: int = None
+        ) -> list:
+    '''
+    Split the TMF-901B of a large study into documents of part_rows tests
+    each and write them into a zip file at output, a path or a file object.
+    Tests are matched to strip images once for the whole study, then the
+    parts are built in up to workers processes (None for one per core) and
+    added to the zip in order. A worker only holds the part it is building,
+    so the time and memory a part takes do not grow with the study. Returns
+    the warnings of the whole document.
+    '''
+    if progress is None:
+        progress = Progress()
+    if metrics is None:
+        metrics = RunMetrics()
+    workers = os.cpu_count() if workers is None else workers
+
+    df = df[~df['Test Type'].isin(TESTS_TO_IGNORE)]
+    match = match_strip_images(df, config)
+    starts = range(0, max(len(df), 1), part_rows)
+    parts = len(starts)
+
+    pic_ct = 0
+    skipped_tests = []
+    ambiguous_tests = []
+    with metrics.stage('tmf901b parts', 'images') as stage:
+        # docx files are already compressed, so the parts are stored as is.
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive, \
+                ProcessPoolExecutor(max_workers=min(workers, parts)) as executor:
+            results = executor.map(
+                tmf901b_part,
+                [df.iloc[i:i + part_rows] for i in starts],
+                [match.iloc[i:i + part_rows] for i in starts],
+                repeat(config), repeat(date_comp), repeat(version),
+                range(1, parts + 1), repeat(parts)
+                )
+            for part, (data, part_ct, warnings) in enumerate(results, 1):
+                archive.writestr(config.part_name(part, parts), data)
+                pic_ct += part_ct
+                for warning in warnings:
+                    if warning.kind == AMBIGUOUS_IMAGES:
+                        ambiguous_tests += warning.items
+                    else:
+                        skipped_tests += warning.items
+                progress.update('TMF-901B parts built', part, parts)
+        stage.count = pic_ct
+
+    warnings = missing_images_warnings(skipped_tests, ambiguous_tests)
+    return warnings + strip_count_warnings(expected_strips(config), pic_ct)
+
+
+def append_tmf901b(
+        df: pd.DataFrame, config: PdsConfig, date_comp: str,
+        version: str = VERSION, progress: Progress = None,
+        metrics: RunMetrics = None
+        ) -> tuple:
+    '''
+    Add rows for the tests in df to the end of a TMF-901B made earlier by
+    generate_tmf901b and update its date stamp, without rebuilding the rows
+    already in it. Returns the path of the document and a list of warnings.
+    '''
+    if progress is None:
+        progress = Progress()
+    if metrics is None:
+        metrics = RunMetrics()
+
+    document = Document(config.doc_path)
+    stamp_tmf901b(document, version, date_comp)
+    with metrics.stage('tmf901b images', 'images') as stage:
+        stage.count, warnings = add_tmf901b_rows(document, df, config, progress)
+    with metrics.stage('tmf901b save'):
+        document.save(config.doc_path)
+
+    return config.doc_path, warnings
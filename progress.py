@@ -0,0 +1,26 @@
+class Progress:
+    '''
+    Progress callback interface for long running pipeline steps. Steps call
+    update with a short description of what is being counted, the number of
+    items done and the total expected. The base class ignores updates, so
+    it can be passed when nothing needs to be shown.
+    '''
+    def update(self, stage: str, done: int, total: int):
+        pass
+
+
+class StreamlitProgress(Progress):
+    '''
+    Shows updates as a Streamlit progress bar with a "stage: done of total"
+    line above it.
+    '''
+    def __init__(self):
+        # imported here so the core pipeline does not depend on Streamlit.
+        import streamlit as sl
+
+        self.text = sl.empty()
+        self.bar = sl.progress(0)
+
+    def update(self, stage: str, done: int, total: int):
+        self.text.text('{}: {} of {}'.format(stage, done, total))
+        self.bar.progress(min(done / total, 1.0) if total else 1.0)
@@ -0,0 +1,142 @@
+'''
+Replicate QC statistics added to the replicate stats table when they are
+selected: a Shapiro-Wilk test of each condition and line, and a screen of
+every specimen's replicates for an outlier.
+
+Both work on the deviations of the replicates from their specimen's mean,
+pooled over the specimens of a condition, since the replicates of different
+specimens are not expected to share a mean, and a specimen's own 3 to 9
+replicates are too few to estimate a spread from. Shapiro-Wilk is run on
+the pooled deviations, and its p value is the same on every row of the
+condition.
+
+The outlier screen is a Grubbs test with the replicate SD of the condition
+taken as known: the replicate furthest from its specimen's mean is an
+outlier if its deviation, in SDs, is more than outlier_limit of the number
+of replicates. The limit is set so that a specimen of normal data is
+flagged with probability OUTLIER_ALPHA at most. The SD is estimated from
+the MAD of the pooled deviations, or their mean absolute deviation if the
+MAD is 0, so outliers do not inflate it. Conditions with fewer than
+MIN_POOLED deviations are not screened.
+'''
+import numpy as np
+import pandas as pd
+from scipy import stats as st
+
+
+SHAPIRO = 'Shapiro p'
+OUTLIERS = 'Outliers'
+QC_STAT_KEYS = [SHAPIRO, OUTLIERS]
+
+# chance that a specimen of normal data is flagged, per line.
+OUTLIER_ALPHA = 0.01
+
+# fewest pooled deviations the SD of a condition is estimated from.
+MIN_POOLED = 20
+
+# scale factors that make the MAD and mean absolute deviation comparable
+# to the SD of normal data.
+MAD_SCALE = 0.6745
+MEAN_AD_SCALE = 1.253314
+
+
+def replicate_values(table: pd.DataFrame, line: str, rep_qty: int) -> np.ndarray:
+    columns = ['{} rep {}'.format(line, j + 1) for j in range(rep_qty)]
+    return table[columns].to_numpy(dtype=float)
+
+
+def deviations(values: np.ndarray) -> np.ndarray:
+    '''
+    Deviations of the replicates in every row of values from the row's mean.
+    '''
+    with np.errstate(invalid='ignore'):
+        return values - np.nanmean(values, axis=1, keepdims=True)
+
+
+def replicate_sd(values: np.ndarray) -> float:
+    '''
+    Robust SD of the replicates of the rows of values, the specimens of one
+    condition, from their pooled deviations from their row's mean. NaN if
+    there are fewer than MIN_POOLED deviations or all of them are 0.
+    '''
+    rep_qty = values.shape[1]
+    pooled = deviations(values).ravel()
+    pooled = pooled[np.isfinite(pooled)]
+    if len(pooled) < MIN_POOLED or rep_qty < 2:
+        return np.nan
+
+    mad = np.median(np.abs(pooled - np.median(pooled)))
+    sd = mad / MAD_SCALE if mad > 0 else MEAN_AD_SCALE * np.mean(np.abs(pooled))
+    if sd == 0:
+        return np.nan
+    # deviations from the mean of n values have n / (n - 1) less variance.
+    return sd * np.sqrt(rep_qty / (rep_qty - 1))
+
+
+def outlier_limit(rep_qty: int, alpha: float = OUTLIER_ALPHA) -> float:
+    '''
+    Largest deviation from its specimen's mean, in replicate SDs, that the
+    furthest of rep_qty normal replicates exceeds with probability alpha at
+    most (Bonferroni over the replicates).
+    '''
+    return np.sqrt((rep_qty - 1) / rep_qty) * st.norm.isf(alpha / (2 * rep_qty))
+
+
+def outlier_labels(values: np.ndarray, alpha: float = OUTLIER_ALPHA) -> np.ndarray:
+    '''
+    "#n" label of the outlying replicate of every row of values, the
+    specimens of one condition, empty if there is none.
+    '''
+    labels = np.full(len(values), '', dtype=object)
+    sd = replicate_sd(values)
+    if np.isnan(sd):
+        return labels
+
+    with np.errstate(invalid='ignore'):
+        score = np.abs(deviations(values)) / sd
+    score = np.where(np.isfinite(score), score, 0.0)
+    furthest = score.argmax(axis=1)
+    outlying = score[np.arange(len(values)), furthest] > outlier_limit(values.shape[1], alpha)
+    for row in np.flatnonzero(outlying):
+        labels[row] = '#{}'.format(furthest[row] + 1)
+    return labels
+
+
+def shapiro_p(values: np.ndarray) -> float:
+    '''
+    Shapiro-Wilk p value of the pooled deviations of the rows of values from
+    their means, NaN if there are fewer than 3 or they are all equal.
+    '''
+    pooled = deviations(values).ravel()
+    pooled = pooled[np.isfinite(pooled)]
+    if len(pooled) < 3 or np.ptp(pooled) == 0:
+        return np.nan
+    return round(float(st.shapiro(pooled).pvalue), 3)
+
+
+def add_qc_stats(
+    table: pd.DataFrame, rep_qty: int, lines: list, rep_stats: list
+    ) -> pd.DataFrame:
+    '''
+    The replicate stats table with a '{line} Shapiro p' and '{line} Outliers'
+    column for every line, for the QC stats in rep_stats.
+    '''
+    selected = [stat for stat in QC_STAT_KEYS if stat in rep_stats]
+    if len(selected) == 0:
+        return table
+
+    table = table.copy()
+    groups = list(table.groupby('Condition', sort=False).indices.values())
+    for line in lines:
+        values = replicate_values(table, line, rep_qty)
+        if OUTLIERS in selected:
+            labels = np.full(len(table), '', dtype=object)
+            for rows in groups:
+                labels[rows] = outlier_labels(values[rows])
+            table['{} {}'.format(line, OUTLIERS)] = labels
+        if SHAPIRO in selected:
+            p = np.full(len(table), np.nan)
+            for rows in groups:
+                p[rows] = shapiro_p(values[rows])
+            table['{} {}'.format(line, SHAPIRO)] = p
+    return table
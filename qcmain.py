@@ -1,31 +1,29 @@
 import os
 import streamlit as sl
 import pandas as pd
-import re
-from docx import Document
 from pathlib import Path
 
+import export_cache
+import ingest
+import jobs
+import pds
+from progress import Progress
+import strip_images
+import test_ids
+
 class QcClass:
+
+    __slots__ = (
+        'test_ID', 'sublot', 'sample', 'num', 'test_type', 'ltr_pos', 
+        'ctrl_val', 'ver_val', 'ltr_val', 'time', 'date'
+        )
     
-    def __init__(self, test_ID, test_num, test_type, ltr_pos, ctrl_val, 
-                        ver_val, ltr_val, time, date):
+    def __init__(self, test_ID, sublot, sample, test_num, test_type, ltr_pos, 
+                        ctrl_val, ver_val, ltr_val, time, date):
     
         self.test_ID = test_ID
-        print(test_ID)
-        
-        sublot_pattern = 'sublot_[A-Z].[A-Z] '
-        #pm_pattern = '9169 [0-7][0-9]'
-        pm_pattern = 'Sample [0-9]'
-        neg_pat = 'N [0-9]+'
-        
-        
-        if self.test_ID.startswith('N'):
-            self.sample = re.findall(neg_pat, test_ID)[0]
-            self.sublot = 'A' # re.findall(sublot_pattern, test_ID)[0]
-        else:
-            self.sublot = re.findall(sublot_pattern, test_ID)[0]
-            self.sample = re.findall(pm_pattern, test_ID)[0]
-        
+        self.sublot = sublot
+        self.sample = sample
         
         self.num = test_num
         self.test_type = test_type
@@ -37,12 +35,7 @@ class QcClass:
         self.date = date
         
     def generate_foldername(self):
-        d = str(self.date[2:])
-        t = str(self.time)
-    
-        folder_name = d.replace('-', '') + '_' + t.replace(':', '_')
-        
-        return folder_name
+        return strip_images.folder_name(self.date, self.time)
         
 
 
@@ -57,31 +50,94 @@ def image(foldernames, strip_images):
     return strip_image_dict
     
 
+def retest_order(test) -> tuple:
+    '''
+    Sort key for retests of the same sample: test number, then acquisition
+    time for tests without a number.
+    '''
+    num = -1 if pd.isna(test.num) else int(test.num)
+    return (num, str(test.date), str(test.time))
+
+
+def resolve_retests(tests: list, retest_pat: str = 'retest') -> tuple:
+    '''
+    Replace every test that was retested with the latest retest of the same
+    (sublot, sample). Retests are indexed by (sublot, sample) in one pass, so
+    this stays linear however often a sample was retested, and ties go to
+    the retest later in the export. Returns the resolved tests in export
+    order, the superseded (original, retest) pairs and the retests that did
+    not match any test.
+    '''
+    originals = []
+    latest = {}
+    for test in tests:
+        if retest_pat in test.test_ID:
+            key = (test.sublot, test.sample)
+            if key not in latest or retest_order(test) >= retest_order(latest[key]):
+                latest[key] = test
+        else:
+            originals.append(test)
+
+    test_objects = []
+    superseded = []
+    matched = set()
+    for test in originals:
+        key = (test.sublot, test.sample)
+        if key in latest:
+            test_objects.append(latest[key])
+            superseded.append((test, latest[key]))
+            matched.add(key)
+        else:
+            test_objects.append(test)
+
+    unmatched = [rt for key, rt in latest.items() if key not in matched]
+
+    return test_objects, superseded, unmatched
+
+
+def retest_warnings(superseded: list, unmatched: list) -> list:
+    '''
+    Warnings listing the tests replaced by retests and the retests left out.
+    '''
+    warnings = []
+    if len(superseded) > 0:
+        pairs = ['{} -> {}'.format(test.test_ID, rt.test_ID) for test, rt in superseded]
+        warnings.append(pds.PipelineWarning(
+            pds.RETESTS,
+            'The following tests were replaced by their retest: {}.'.format(
+                ', '.join(pairs)),
+            tuple(test.test_ID for test, _ in superseded)
+            ))
+    if len(unmatched) > 0:
+        ids = [rt.test_ID for rt in unmatched]
+        warnings.append(pds.PipelineWarning(
+            pds.UNMATCHED_RETESTS,
+            '''No original test was found for the following retests, so they
+            were left out: {}.'''.format(', '.join(ids)),
+            tuple(ids)
+            ))
+    return warnings
+
+
 def inst(
         test_ID, test_num, test_type, ltr_pos, ctrl_val, 
                         ver_val, ltr_val, strip_image_dict, time, date
-                        ):        
-    test_objects = []
-    retests = []
-    retest_pat = 'retest'
-    
-    for i, test in enumerate(test_ID):
-        if 'buffer' not in test_ID[i]:
-            
-            temp_test = QcClass(test_ID[i], test_num[i], test_type[i], ltr_pos[i], ctrl_val[i], 
-                            ver_val[i], ltr_val[i], time[i], date[i])
-            
-            if retest_pat in temp_test.test_ID:
-                retests.append(temp_test)
-            else:
-                test_objects.append(temp_test)
+                        ) -> tuple:
+    ids = pd.Series(test_ID, dtype=str)
+    keep = ~ids.str.contains('buffer', regex=False).to_numpy()
+    parsed = test_ids.parse_qc_ids(ids[keep])
+
+    tests = [
+        QcClass(*values) for values in zip(
+            ids[keep], parsed['Sublot'], parsed['Sample'], test_num[keep], 
+            test_type[keep], ltr_pos[keep], ctrl_val[keep], ver_val[keep], 
+            ltr_val[keep], time[keep], date[keep]
+            )
+        ]
 
-    for rt in retests:
-        for i, test in enumerate(test_objects):
-            if rt.sample == test.sample and rt.test_ID != test.test_ID and rt.sublot == test.sublot:
-                    test_objects[i] = rt
+    test_objects, superseded, unmatched = resolve_retests(tests)
 
-    return test_objects
+    return test_objects, retest_warnings(superseded, unmatched)
 
 
 
@@ -100,34 +156,53 @@ def read_in(csv, file_name, foldernames, strip_images):
     # returns dictionary with foldername as key and image as value. 
     strip_image_dict = image(foldernames, strip_images)
     
-    test_objects = inst(
+    test_objects, warnings = inst(
                         test_ID, test_num, test_type, ltr_pos, ctrl_val, 
                         ver_val, ltr_val, strip_image_dict, time, date
                         )
     
     # excel_handle(test_objects, ss, qsf_file_name)
     
-    return test_objects, strip_image_dict
+    return test_objects, strip_image_dict, warnings
     
         
 
-def generate_tmf901b(test_objects, tmf901b, strip_image_dict, filepath):
-
-    document = Document(tmf901b)
+def generate_tmf901b(
+        test_objects, tmf901b, strip_image_dict, filepath, 
+        progress: Progress = None
+        ):
+    '''
+    Fill a copy of the blank TMF-901B in tmf901b, anything pds.read_template
+    takes, with a row and strip image for every QC test. Returns the document
+    and a list of pds.PipelineWarning.
+    '''
+    if progress is None:
+        progress = Progress()
+
+    document = pds.read_template(tmf901b)
     
     tbl = document.tables[1]
 
-    # progress bar
-    latest_iteration = sl.empty()
-    bar = sl.progress(0)
-    pc = 100/100/(len(test_objects))
     expected_strip_ct = len(test_objects)
-    pic_ct = 1
-    prog_bar_val = 0
+    pic_ct = 0
+
+    # match tests to the images in the folder, then read and downsize every
+    # image up front before the table is built.
+    folder = os.path.join(Path(__file__).parent, filepath)
+    acquired = ingest.parse_acquired(
+        pd.Series([test.date for test in test_objects], dtype=str),
+        pd.Series([test.time for test in test_objects], dtype=str)
+        )
+    match = strip_images.match_strip_images(
+        acquired, strip_images.index_strip_images(folder)
+        )
+    images = strip_images.load_strip_images(
+        match['Path'].tolist(), cache=strip_images.ThumbnailCache()
+        )
 
     skipped_tests = []
-    for i, test in enumerate(test_objects):
-
+    ambiguous_tests = []
+    for test, image, found in zip(test_objects, images, match['Match']):
 
         # Test No.
         row_cells = tbl.add_row().cells
@@ -163,43 +238,31 @@ def generate_tmf901b(test_objects, tmf901b, strip_image_dict, filepath):
         run = paragraph.add_run(str(round(test.ltr_val, 3)))
 
 
-        # try:
+        if found == strip_images.AMBIGUOUS:
+            ambiguous_tests.append(test.test_ID)
+            continue
+        if image is None:
+            skipped_tests.append(test.test_ID)
+            continue
+
         # strip image
         paragraph = row_cells[-3].paragraphs[0]
         run = paragraph.add_run()
-        #run.add_picture(test.strip_image, width=3100000, height=660000)
-        root = Path(__file__).parent
-        picture = os.path.join(root, (filepath + '/' + test.generate_foldername() + '/Strip.jpg'))
-        run.add_picture(picture, width=3100000, height=660000)
-        # 'Streamlit_rakuten/' + 
+        run.add_picture(
+            image, width=strip_images.STRIP_WIDTH, 
+            height=strip_images.STRIP_HEIGHT
+            )
         
         a, b, c = row_cells[-3:]
         a.merge(b)
         a.merge(c)
-        # Update the progress bar with each iteration.
-        latest_iteration.text('Strip images moved: {} of {}'.format(
-            pic_ct, expected_strip_ct)
-            )
-        bar.progress(prog_bar_val)
-        prog_bar_val += pc
-        pic_ct += 1
-        # except:
-        #     skipped_tests.append(test.test_ID)
 
-    bar.progress(100)
+        pic_ct += 1
+        progress.update('Strip images moved', pic_ct, expected_strip_ct)
 
-    if len(skipped_tests) > 0:
-        sl.error(
-            "Could not find strip images for the following tests: {}.".format(
-                ', '.join(skipped_tests)))
-        sl.error('''Verify that Test Date is in YYYY-MM-DD format and that 
-                 Time Acquired is in HH:MM:SS 24hr format in data.csv.'''
-                 )
+    warnings = pds.missing_images_warnings(skipped_tests, ambiguous_tests)
 
-    #document.save('test file.docx')
-    #sl.download_button('Download TMF-901B', document, file_name='TMF-90B.txt')
-             
-    return document
+    return document, warnings
 
 
 
@@ -238,23 +301,28 @@ def main():
     done = sl.button('Done')
     
     if done == True: 
-        test_objects, strip_image_dict = read_in(
-            pd.read_csv(csv), file_name, foldernames, strip_images
+        test_objects, strip_image_dict, retests = read_in(
+            export_cache.load_export(csv.getvalue()), file_name, foldernames, 
+            strip_images
             )
         
         sl.text(strip_image_dict)
+        for warning in retests:
+            if warning.kind == pds.RETESTS:
+                sl.info(warning.message)
+            else:
+                sl.error(warning.message)
         
-        file = generate_tmf901b(test_objects, tmf901b, strip_image_dict, filepath)
-    
-        file.save('test.docx')
-        
-        f = open('test.docx', 'rb')
-        sl.download_button("Download completed TMF-901B", f)
-        f.close()
+        # the document is built in the background; the jobs panel shows its
+        # progress and offers it for download when it is done.
+        job = jobs.submit(
+            file_name + '.docx', jobs.qc_tmf901b, test_objects, tmf901b.getvalue(), 
+            filepath
+            )
+        sl.session_state.setdefault('qc_tmf901b_jobs', []).append(job)
+        sl.info('TMF-901B job {} started.'.format(job.job_id))
         
         if balloons == True:
             sl.balloons()
 
-        
-
-
+    jobs.show_jobs('qc_tmf901b_jobs')
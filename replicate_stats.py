@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+import test_ids
+
+
+# Reader export columns used by the PDS pipeline.
+DATA_COLUMNS = [
+    'Test ID', 'Decision Message 1', 'Decision Message 2',
+    'Decision Message 3', 'Position.1', 'Position.2'
+    ]
+
+# Decision message holding the score of each test line.
+LINE_COLUMNS = {
+    'CTRL': 'Decision Message 1', 'VER': 'Decision Message 2',
+    'LTR': 'Decision Message 3'
+    }
+
+# Scoring window position of each test line.
+POSITION_COLUMNS = {'VER': 'Position.1', 'LTR': 'Position.2'}
+
+# parts of the Test ID, see test_ids.parse_pds_ids.
+KEY_COLUMNS = ['Condition', 'Specimen', 'Replicate']
+
+# Shapiro p and Outliers are added to the table by qc_stats when selected,
+# Shifts by shifts.join_flags.
+STAT_KEYS = ['Mean', 'SD', '%CV', 'Median', 'MAD', 'Shapiro p', 'Outliers', 'Shifts']
+
+
+def compute_replicate_stats(
+    data: pd.DataFrame, rep_qty: int, condition_list: list,
+    multiple_conditions: bool, reps_in_title: bool, keys: pd.DataFrame = None
+    ) -> tuple:
+    '''
+    Group the replicates of every specimen (and condition) and compute the
+    mean, median, SD, %CV and MAD of each test line for all specimens at
+    once. Returns a table with one row per specimen holding the rounded
+    replicate values, line positions and stats, and a list of specimens
+    that could not be grouped because a replicate is duplicated or missing.
+
+    Rounding follows the original per specimen calculation: replicate values
+    are rounded to 3 places before the stats are computed, and %CV is
+    computed from the rounded mean and SD.
+
+    keys can be passed if the test ID's of data were already split.
+    '''
+    if keys is None:
+        keys = test_ids.parse_pds_ids(
+            data['Test ID'], condition_list if multiple_conditions else (),
+            reps_in_title
+            )
+    if multiple_conditions:
+        keep = (keys['Condition'] != '').to_numpy()
+    else:
+        keep = np.ones(len(keys), dtype=bool)
+
+    data = data[keep]
+    keys = keys[keep]
+
+    groups = keys.groupby(['Condition', 'Specimen'], sort=False)
+    group_no = groups.ngroup().to_numpy()
+    complete = (groups['Specimen'].transform('size') == rep_qty).to_numpy()
+
+    incomplete = keys.loc[~complete, ['Condition', 'Specimen']].drop_duplicates()
+    incomplete = [
+        ' '.join(i for i in pair if i) for pair in incomplete.itertuples(index=False)
+        ]
+
+    # order specimens by condition, then by order of appearance.
+    if multiple_conditions:
+        rank = {c: i for i, c in reversed(list(enumerate(condition_list)))}
+        condition_rank = keys['Condition'].map(rank).to_numpy()
+    else:
+        condition_rank = np.zeros(len(keys), dtype=int)
+    order = np.lexsort((group_no, condition_rank))
+    order = order[complete[order]]
+
+    data = data.iloc[order]
+    first = keys.iloc[order[::rep_qty]]
+
+    table = {
+        'Condition': first['Condition'].to_numpy(),
+        'Specimen': first['Specimen'].to_numpy()
+        }
+
+    for line, column in LINE_COLUMNS.items():
+        values = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+        values = np.round(values.reshape(-1, rep_qty), 3)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.round(values.mean(axis=1), 3)
+            median = np.round(np.median(values, axis=1), 3)
+            sd = np.round(values.std(axis=1, ddof=1), 3)
+            cv = np.round(sd / mean * 100, 1)
+        mad = np.round(np.median(np.abs(values - median[:, None]), axis=1), 3)
+
+        for j in range(rep_qty):
+            table['{} rep {}'.format(line, j + 1)] = values[:, j]
+        stats = {'Mean': mean, 'SD': sd, '%CV': cv, 'Median': median, 'MAD': mad}
+        for stat, value in stats.items():
+            table['{} {}'.format(line, stat)] = value
+
+    for line, column in POSITION_COLUMNS.items():
+        positions = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+        positions = positions.reshape(-1, rep_qty)
+        for j in range(rep_qty):
+            table['{} position {}'.format(line, j + 1)] = positions[:, j]
+
+    return pd.DataFrame(table), incomplete
+
+
+def relevant_mask(
+    data: pd.DataFrame, panel: list, condition_list: list,
+    multiple_conditions: bool, reps_in_title: bool, keys: pd.DataFrame = None
+    ) -> pd.Series:
+    '''
+    Boolean mask of the rows whose specimen is in the panel, and whose condition
+    is one of the experimental conditions if there are any.
+    '''
+    if keys is None:
+        keys = test_ids.parse_pds_ids(
+            data['Test ID'], condition_list if multiple_conditions else (),
+            reps_in_title
+            )
+    relevant = keys['Specimen'].isin(set(panel))
+
+    if multiple_conditions:
+        relevant &= keys['Condition'].isin(set(condition_list))
+
+    return relevant
+
+
+def format_headers(
+    lines: list, lots: list, rep_stats: list, multiple_conditions: bool
+    ) -> list:
+    '''
+    Headers of the formatted data table, one block per line.
+    '''
+    headers = []
+
+    for line in lines:
+        if multiple_conditions:
+            headers.append('Condition')
+        headers.append(" ".join([line, '|', 'Sample']))
+        for lot in lots:
+            headers.append(lot)
+        for stat in rep_stats:
+            headers.append(stat)
+        headers.append(' ')
+
+    return headers
+
+
+def row_columns(
+    rep_qty: int, lines: list, rep_stats: list, multiple_conditions: bool
+    ) -> list:
+    '''
+    Replicate stats table column behind each cell of a formatted row, None
+    for the spacer between line blocks.
+    '''
+    columns = []
+    for line in lines:
+        if multiple_conditions:
+            columns.append('Condition')
+        columns.append('Specimen')
+        columns.extend('{} rep {}'.format(line, j + 1) for j in range(rep_qty))
+        columns.extend('{} {}'.format(line, stat) for stat in rep_stats)
+        columns.append(None)
+
+    # drop the spacer after the last line block.
+    return columns[:-1]
+
+
+def specimen_rows(
+    table: pd.DataFrame, rep_qty: int, lines: list, rep_stats: list,
+    multiple_conditions: bool
+    ) -> list:
+    '''
+    One formatted row per specimen in the replicate stats table, holding a
+    block of replicate values and selected stats for every line.
+    '''
+    columns = row_columns(rep_qty, lines, rep_stats, multiple_conditions)
+    cells = [
+        table[c].tolist() if c is not None else [' '] * len(table)
+        for c in columns
+        ]
+    return [list(row) for row in zip(*cells)]
+
+
+def format_rows(
+    table: pd.DataFrame, rep_qty: int, lines: list, rep_stats: list,
+    condition_list: list, multiple_conditions: bool
+    ) -> list:
+    '''
+    Build the rows of the formatted data table from the replicate stats
+    table. Conditions are separated by a blank row.
+    '''
+    rows = specimen_rows(table, rep_qty, lines, rep_stats, multiple_conditions)
+
+    if not multiple_conditions:
+        return rows + [[' ']]
+
+    by_condition = {condition: [] for condition in condition_list}
+    for row, condition in zip(rows, table['Condition']):
+        by_condition[condition].append(row)
+
+    data_for_csv = []
+    for block in by_condition.values():
+        data_for_csv.extend(block)
+        data_for_csv.append([' '])
+    return data_for_csv
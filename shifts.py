@@ -0,0 +1,121 @@
+'''
+Detection of strips whose VER or LTR scoring position has shifted, which
+usually means color creep or covertape was mistaken for the line. The check
+runs on the position columns of the replicate stats table of a whole run at
+once and returns a flag table with one row per flagged strip.
+
+A strip is flagged if its position is past the assay's fixed limit for the
+line, or, if a baseline k is set, if it is more than k MADs from the median
+position of that line over the run.
+'''
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+# stat of the flagged strips of each line, see join_flags.
+SHIFTS = 'Shifts'
+
+FLAG_COLUMNS = [
+    'Condition', 'Specimen', 'Line', 'Strip', 'Position', 'Reason', 'Bound'
+    ]
+
+
+@dataclass(frozen=True)
+class ShiftLimits:
+    '''
+    Position limits of a line, in reader pixels. A line with no limit is
+    only checked against the baseline. k is the number of MADs a position
+    may be from the run median before it is flagged, None to skip the
+    baseline check. min_mad keeps a run of nearly identical positions from
+    flagging a move of a pixel or two.
+    '''
+    ver: float = 330
+    ltr: float = 530
+    k: float = None
+    min_mad: float = 2.0
+
+    def limit(self, line: str):
+        return getattr(self, line.lower(), None)
+
+
+ASSAY_LIMITS = {
+    'Rapid Recency': ShiftLimits(ver=330, ltr=530),
+    # Oral Fluid strips have no LT/R line.
+    'Oral Fluid': ShiftLimits(ver=330, ltr=None),
+    }
+
+
+def line_flags(table: pd.DataFrame, line: str, rep_qty: int, limits: ShiftLimits) -> pd.DataFrame:
+    '''
+    Flag table of one line. Strips past the fixed limit are flagged with
+    Reason 'limit', other strips outside the baseline with Reason 'baseline'.
+    Bound is the limit or baseline bound that was crossed.
+    '''
+    columns = ['{} position {}'.format(line, j + 1) for j in range(rep_qty)]
+    if not set(columns).issubset(table.columns):
+        return pd.DataFrame(columns=FLAG_COLUMNS)
+    positions = table[columns].to_numpy(dtype=float)
+
+    limit = limits.limit(line)
+    bound = np.full(positions.shape, np.nan)
+    over_limit = np.zeros(positions.shape, dtype=bool)
+    if limit is not None:
+        over_limit = positions > limit
+        bound[over_limit] = limit
+
+    outside = np.zeros(positions.shape, dtype=bool)
+    if limits.k is not None and np.isfinite(positions).any():
+        median = np.nanmedian(positions)
+        mad = max(np.nanmedian(np.abs(positions - median)), limits.min_mad)
+        low, high = median - limits.k * mad, median + limits.k * mad
+        outside = ~over_limit & ((positions < low) | (positions > high))
+        bound[outside] = np.where(positions[outside] > high, high, low)
+
+    rows, strips = np.nonzero(over_limit | outside)
+    return pd.DataFrame({
+        'Condition': table['Condition'].to_numpy()[rows],
+        'Specimen': table['Specimen'].to_numpy()[rows],
+        'Line': line,
+        'Strip': strips + 1,
+        'Position': positions[rows, strips],
+        'Reason': np.where(over_limit[rows, strips], 'limit', 'baseline'),
+        'Bound': bound[rows, strips],
+        }, columns=FLAG_COLUMNS)
+
+
+def detect_shifts(table: pd.DataFrame, rep_qty: int, limits: ShiftLimits) -> pd.DataFrame:
+    '''
+    Flag table of the LTR and VER lines of every specimen in a replicate
+    stats table, LTR flags first.
+    '''
+    flags = [line_flags(table, line, rep_qty, limits) for line in ['LTR', 'VER']]
+    return pd.concat(flags, ignore_index=True)
+
+
+def flag_labels(flags: pd.DataFrame, line: str) -> list:
+    '''
+    "condition specimen strip #n" labels of a line's flagged strips.
+    '''
+    flags = flags[flags['Line'] == line]
+    names = (flags['Condition'] + ' ' + flags['Specimen']).str.strip()
+    return ['{} strip #{}'.format(n, s) for n, s in zip(names, flags['Strip'])]
+
+
+def join_flags(table: pd.DataFrame, flags: pd.DataFrame, lines: list) -> pd.DataFrame:
+    '''
+    The replicate stats table with a '{line} Shifts' column for every line,
+    listing the flagged strips of each specimen as "#1, #3", empty if none
+    were. Only VER and LTR are checked, the other lines get an empty column
+    so every line block of the formatted table can hold the stat.
+    '''
+    table = table.copy()
+    keys = pd.MultiIndex.from_frame(table[['Condition', 'Specimen']])
+    for line in lines:
+        line_flags = flags[flags['Line'] == line]
+        strips = line_flags.groupby(['Condition', 'Specimen'], sort=False)['Strip'].agg(
+            lambda s: ', '.join('#{}'.format(i) for i in s)
+            )
+        table['{} {}'.format(line, SHIFTS)] = strips.reindex(keys).fillna('').to_numpy()
+    return table
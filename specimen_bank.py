@@ -1,6 +1,6 @@
-# gets panel members as value using panel name as a key in a dictionary
-def get_specimens(panel):
-    specimen_bank = {
+# panel members in output order, using panel name as a key in a dictionary.
+# panels.py builds the registry of supported panels from this table.
+SPECIMEN_BANK = {
         '9172': ['9172-01', '9172-02', '9172-03', '9172-04', '9172-05', 
                  '9172-06', '9172-07', '9172-08', '9172-09','9172-10', 
                  '9172-11', '9172-12'],
@@ -49,4 +49,7 @@ def get_specimens(panel):
                              '9168-05', '9168-06', '9172-12']
     }
 
-    return specimen_bank[panel]
+
+# gets panel members as value using panel name as a key in a dictionary
+def get_specimens(panel):
+    return SPECIMEN_BANK[panel]
@@ -0,0 +1,189 @@
+import contextlib
+import csv
+import pickle
+import tempfile
+
+import pandas as pd
+
+import ingest
+import pds
+import qc_stats
+import replicate_stats
+import shifts
+import test_ids
+
+
+CHUNKSIZE = 50000
+
+
+def read_spool(spool) -> pd.DataFrame:
+    '''
+    The tables pickled to a spool, joined, or None if it is empty.
+    '''
+    spool.seek(0)
+    parts = []
+    while True:
+        try:
+            parts.append(pickle.load(spool))
+        except EOFError:
+            break
+    return pd.concat(parts, ignore_index=True) if parts else None
+
+
+def stream_format_data(
+    source, output: str, config: pds.PdsConfig, chunksize: int = CHUNKSIZE
+    ) -> list:
+    '''
+    Format a reader export chunk by chunk and write it to the formatted csv
+    at output. Each chunk is filtered to the panel and conditions as it is
+    read, specimens are formatted as soon as all of their replicates have been
+    read, and only specimens still waiting on replicates are carried over to
+    the next chunk, so memory use depends on the panel rather than the size
+    of the export.
+
+    The stats of the formatted specimens are spooled to a temporary file
+    per condition and joined at the end, one condition at a time, so the csv
+    has the same layout as format_data: a block per condition in the order
+    of config.conditions, specimens in order of first appearance and a blank
+    row after each block. The QC stats, which pool the specimens of a
+    condition, are added to each block as it is joined. A specimen that gets
+    more replicates after it was formatted is dropped and reported as
+    incomplete, as in format_data. Returns warnings for specimens with
+    duplicated or missing replicates and for LTR and VER position shifts.
+    Only the positions of each specimen are kept for the position shift
+    check at the end.
+    '''
+    rep_qty = config.rep_qty
+    lines = config.lines
+    rep_stats = config.rep_stats
+    condition_list = config.conditions
+    multiple_conditions = config.multiple_conditions
+    reps_in_title = config.reps_in_title
+
+    headers = replicate_stats.format_headers(
+        lines, config.lots, rep_stats, multiple_conditions
+        )
+    columns = replicate_stats.DATA_COLUMNS
+    key_columns = ['Condition', 'Specimen']
+
+    position_columns = key_columns + [
+        '{} position {}'.format(line, j + 1) for line in replicate_stats.POSITION_COLUMNS
+        for j in range(rep_qty)
+        ]
+
+    blocks = list(dict.fromkeys(condition_list)) if multiple_conditions else ['']
+
+    # specimens by order of first appearance, the specimens already
+    # formatted and those with duplicated or missing replicates.
+    first_seen = {}
+    formatted = set()
+    incomplete = set()
+    positions = []
+    pending = None
+
+    with contextlib.ExitStack() as stack:
+        spools = {
+            condition: stack.enter_context(tempfile.TemporaryFile())
+            for condition in blocks
+            }
+
+        for chunk in ingest.iter_export(source, chunksize, columns):
+            chunk = chunk[chunk['Decision Message 1'].notna()]
+            if pending is not None:
+                chunk = pd.concat([pending, chunk])
+
+            keys = test_ids.parse_pds_ids(
+                chunk['Test ID'], condition_list, reps_in_title
+                )
+            if config.other_data:
+                keep = replicate_stats.relevant_mask(
+                    chunk, config.panel, condition_list, multiple_conditions,
+                    reps_in_title, keys
+                    )
+            elif multiple_conditions:
+                keep = keys['Condition'] != ''
+            else:
+                keep = pd.Series(True, index=keys.index)
+
+            keep = keep.to_numpy()
+            chunk = chunk[keep]
+            keys = keys[keep]
+
+            for key in keys[key_columns].drop_duplicates().itertuples(index=False, name=None):
+                first_seen.setdefault(key, len(first_seen))
+
+            # replicates of specimens that were already formatted, or found
+            # incomplete, make them incomplete.
+            finished = formatted | incomplete
+            if finished:
+                late = pd.MultiIndex.from_frame(keys[key_columns]).isin(list(finished))
+                incomplete.update(
+                    keys.loc[late, key_columns].itertuples(index=False, name=None)
+                    )
+                chunk = chunk[~late]
+                keys = keys[~late]
+
+            groups = keys.groupby(key_columns, sort=False)
+            sizes = groups['Specimen'].transform('size').to_numpy()
+            done = sizes >= rep_qty
+            pending = chunk[~done]
+            incomplete.update(
+                keys.loc[sizes > rep_qty, key_columns].itertuples(index=False, name=None)
+                )
+
+            table, _ = replicate_stats.compute_replicate_stats(
+                chunk[done], rep_qty, condition_list, multiple_conditions,
+                reps_in_title, keys[done]
+                )
+            table_keys = list(zip(table['Condition'], table['Specimen']))
+            formatted.update(table_keys)
+
+            table['seen'] = [first_seen[key] for key in table_keys]
+            for condition, part in table.groupby('Condition', sort=False):
+                pickle.dump(part, spools[condition])
+            positions.append(table[position_columns + ['seen']])
+
+        # anything left over never received all of its replicates.
+        if pending is not None and len(pending) > 0:
+            keys = test_ids.parse_pds_ids(
+                pending['Test ID'], condition_list, reps_in_title
+                )
+            incomplete.update(keys[key_columns].itertuples(index=False, name=None))
+
+        # specimens found incomplete after they were formatted are left out.
+        dropped = {first_seen[key] for key in incomplete}
+
+        # the baseline of the position shift check is taken over the whole run,
+        # in the order of the csv.
+        if positions:
+            positions = pd.concat(positions, ignore_index=True)
+            positions = positions[~positions['seen'].isin(dropped)]
+            rank = {c: i for i, c in enumerate(blocks)}
+            positions = positions.assign(rank=positions['Condition'].map(rank))
+            positions = positions.sort_values(['rank', 'seen'])[position_columns]
+            positions = positions.reset_index(drop=True)
+        else:
+            positions = pd.DataFrame(columns=position_columns)
+        flags = shifts.detect_shifts(positions, rep_qty, config.shift_limits)
+
+        # join the blocks.
+        with open(output, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(headers)
+            for spool in spools.values():
+                block = read_spool(spool)
+                if block is not None:
+                    block = block[~block['seen'].isin(dropped)]
+                    block = block.sort_values('seen').reset_index(drop=True)
+                    block = qc_stats.add_qc_stats(block, rep_qty, lines, rep_stats)
+                    block = shifts.join_flags(block, flags, lines)
+                    csvwriter.writerows(replicate_stats.specimen_rows(
+                        block, rep_qty, lines, rep_stats, multiple_conditions
+                        ))
+                csvwriter.writerow([' '])
+
+    names = [
+        ' '.join(i for i in key if i)
+        for key in sorted(incomplete, key=first_seen.get)
+        ]
+    return pds.formatting_warnings(names, flags)
@@ -0,0 +1,242 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+from PIL import Image
+
+from disk_cache import DiskCache
+
+
+# Size strip images are shown at in the TMF-901B, in EMU.
+STRIP_WIDTH = 3100000
+STRIP_HEIGHT = 660000
+
+EMU_PER_INCH = 914400
+STRIP_DPI = 200
+
+# Pixel size of a strip image at its display size.
+STRIP_PIXELS = (
+    round(STRIP_WIDTH / EMU_PER_INCH * STRIP_DPI),
+    round(STRIP_HEIGHT / EMU_PER_INCH * STRIP_DPI)
+    )
+
+# quality strip images are re-encoded at.
+JPEG_QUALITY = 90
+
+MAX_WORKERS = 8
+
+CACHE_DIR = os.environ.get(
+    'PDS_THUMBNAIL_CACHE',
+    os.path.join(Path.home(), '.cache', 'pds_data_processing', 'strip_thumbnails')
+    )
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+# strip image folder names, see folder_name.
+FOLDER_FORMAT = '%y%m%d_%H_%M_%S'
+IMAGE_NAME = 'Strip.jpg'
+
+# largest difference between a test's acquisition time and the time in its
+# image folder's name, for readers whose clock drifts from the export.
+MATCH_TOLERANCE = pd.Timedelta(seconds=2)
+
+# match results of match_strip_images.
+FOUND = 'found'
+MISSING = 'missing'
+AMBIGUOUS = 'ambiguous'
+
+
+def folder_name(test_date: str, time_acquired: str) -> str:
+    '''
+    Name of the folder the reader saves a test's strip image in, YYMMDD_HH_MM_SS,
+    from its Test Date (YYYY-MM-DD) and Time Acquired (HH:MM:SS).
+    '''
+    d = str(test_date[2:])
+    t = str(time_acquired)
+
+    return d.replace('-', '') + '_' + t.replace(':', '_')
+
+
+def index_strip_images(folder: str) -> dict:
+    '''
+    Strip image paths in a strip_images folder keyed by the acquisition time
+    in their folder's name, from a single scan of the folder. Entries whose
+    name is not a reader folder name are skipped, and an empty index is
+    returned if the folder does not exist.
+    '''
+    index = {}
+    try:
+        with os.scandir(folder) as it:
+            for e in it:
+                if not e.is_dir():
+                    continue
+                try:
+                    acquired = datetime.strptime(e.name, FOLDER_FORMAT)
+                except ValueError:
+                    continue
+                index[pd.Timestamp(acquired)] = os.path.join(e.path, IMAGE_NAME)
+    except OSError:
+        pass
+    return index
+
+
+def match_strip_images(
+    acquired: pd.Series, index: dict, tolerance: pd.Timedelta = MATCH_TOLERANCE
+    ) -> pd.DataFrame:
+    '''
+    Join tests, by acquisition time, to the image in index nearest to it
+    within tolerance. Returns a frame with a row per test, in order, with the
+    image 'Path' and the 'Match': FOUND, MISSING if no image is close enough
+    (or the test's time did not parse) or AMBIGUOUS if its nearest image is
+    also the nearest image of another test and was taken at neither test's
+    time. Only found tests have a path.
+    '''
+    # both sides at the same resolution, as merge_asof requires.
+    tests = pd.DataFrame({
+        'Acquired': pd.Series(acquired).reset_index(drop=True).astype('datetime64[ns]'),
+        'Row': range(len(acquired))
+        })
+    images = pd.DataFrame({
+        'Acquired': pd.Series(list(index), dtype='datetime64[ns]'),
+        'Path': pd.Series(list(index.values()), dtype=object)
+        })
+    images['Image Acquired'] = images['Acquired']
+
+    joined = pd.merge_asof(
+        tests.dropna(subset=['Acquired']).sort_values('Acquired'),
+        images.sort_values('Acquired'), on='Acquired',
+        direction='nearest', tolerance=tolerance
+        )
+    joined = joined.dropna(subset=['Path'])
+
+    # an image taken at exactly a test's time belongs to that test. tests
+    # that are only near an image that is nearest to other tests too cannot
+    # be told apart.
+    exact = joined['Acquired'] == joined['Image Acquired']
+    taken = exact.groupby(joined['Path']).transform('any')
+    joined = joined[exact | ~taken]
+    exact = exact[joined.index]
+    claims = joined.groupby('Path')['Row'].transform('size')
+    ambiguous = ~exact & (claims > 1)
+    found = joined[~ambiguous]
+
+    match = pd.DataFrame({'Path': None, 'Match': MISSING}, index=tests.index)
+    match.loc[found['Row'], 'Path'] = found['Path'].to_numpy()
+    match.loc[found['Row'], 'Match'] = FOUND
+    match.loc[joined.loc[ambiguous, 'Row'], 'Match'] = AMBIGUOUS
+    return match
+
+
+def render_tag() -> str:
+    '''
+    Short digest of the settings strip images are downsized and encoded with.
+    '''
+    settings = json.dumps([STRIP_PIXELS, STRIP_DPI, JPEG_QUALITY])
+    return hashlib.sha256(settings.encode()).hexdigest()[:12]
+
+
+class ThumbnailCache(DiskCache):
+    '''
+    On disk cache of strip images already downsized and re-encoded for the
+    TMF-901B. Entries are keyed by the strip image folder name, the
+    modification time of the image and the render tag, so neither a retaken
+    image nor one rendered with other settings is ever served. Reading an
+    entry marks it as recently used, and the least recently used entries are
+    removed once the cache grows past max_bytes.
+    '''
+    suffix = '.jpg'
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        self.tag = render_tag()
+
+    def entry(self, path: str):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        return os.path.join(
+            self.directory, '{}_{}_{}.jpg'.format(folder, mtime, self.tag)
+            )
+
+    def get(self, path: str):
+        entry = self.entry(path)
+        if entry is None:
+            return None
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+            self.touch(entry)
+        except OSError:
+            return None
+        return io.BytesIO(data)
+
+    def put(self, path: str, buffer: io.BytesIO):
+        entry = self.entry(path)
+        if entry is None:
+            return
+
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(buffer.getvalue())
+
+        self.write(entry, write)
+
+
+def load_strip_image(path: str, cache: ThumbnailCache = None):
+    '''
+    Read a strip image, check that it decodes, and downsize it to the size
+    it is shown at in the TMF-901B. Returns the re-encoded JPEG in a BytesIO
+    ready for run.add_picture, or None if the image is missing or unreadable.
+    Images found in the cache are returned without being decoded. path is
+    None for a test without an image.
+    '''
+    if path is None:
+        return None
+
+    if cache is not None:
+        cached = cache.get(path)
+        if cached is not None:
+            return cached
+
+    try:
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+    except (OSError, ValueError):
+        return None
+
+    width = min(image.width, STRIP_PIXELS[0])
+    height = min(image.height, STRIP_PIXELS[1])
+    if (width, height) != image.size:
+        image = image.resize((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=JPEG_QUALITY, dpi=(STRIP_DPI, STRIP_DPI))
+    buffer.seek(0)
+
+    if cache is not None:
+        cache.put(path, buffer)
+
+    return buffer
+
+
+def load_strip_images(
+    paths: list, max_workers: int = MAX_WORKERS, cache: ThumbnailCache = None
+    ) -> list:
+    '''
+    Load all strip images concurrently. Image decoding releases the GIL so
+    threads keep the disk and the cores busy while the docx is assembled
+    serially afterwards. Returns one BytesIO (or None) per path, in order.
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        images = list(pool.map(lambda path: load_strip_image(path, cache), paths))
+
+    if cache is not None:
+        cache.evict()
+
+    return images
@@ -0,0 +1,102 @@
+'''
+Test ID parsing for the PDS and QC pipelines. A whole 'Test ID' column is
+parsed with one str.extract pass over precompiled patterns, and the
+pipeline steps read the resulting columns instead of parsing the strings
+again.
+
+PDS Test ID's follow the "condition specimen-rep" naming convention in the
+documentation, for example '4C 9172-01-1'. QC Test ID's hold the sublot and
+sample, for example 'sublot_A.B Sample 3', and negatives are named 'N 12'.
+'''
+from functools import lru_cache
+import re
+
+import pandas as pd
+
+
+# first word of a Test ID, which is the condition if the study has any.
+CONDITION_PATTERN = re.compile(r'(?P<Condition>[A-Za-z0-9]+) ')
+
+# the patterns are searched anywhere in the ID, independently of each other.
+QC_PATTERN = re.compile(
+    r'^(?=(?:.*?(?P<Sublot>sublot_[A-Z].[A-Z] ))?)'
+    r'(?=(?:.*?(?P<Sample>Sample [0-9]))?)'
+    r'(?=(?:.*?(?P<Negative>N [0-9]+))?)'
+    )
+
+# negatives are not made from a sublot.
+NEGATIVE_SUBLOT = 'A'
+
+
+@lru_cache(maxsize=32)
+def pds_pattern(conditions: tuple, reps_in_title: bool) -> re.Pattern:
+    '''
+    Pattern splitting a PDS Test ID into condition, specimen and replicate.
+    Conditions may contain spaces, so those with the most words are tried
+    first, then the longest, then in alphabetical order, so the pattern does
+    not depend on set order. IDs that do not start with a condition get no
+    condition.
+    '''
+    pattern = ''
+    if len(conditions) > 0:
+        alternatives = sorted(set(conditions), key=lambda c: (-c.count(' '), -len(c), c))
+        pattern += r'(?:(?P<Condition>{}) )?'.format('|'.join(map(re.escape, alternatives)))
+    else:
+        pattern += r'(?P<Condition>)'
+
+    if reps_in_title:
+        # the replicate is the last character, after a separator.
+        pattern += r'(?P<Specimen>.*).(?P<Replicate>.)'
+    else:
+        pattern += r'(?P<Specimen>.*)(?P<Replicate>)'
+
+    return re.compile('^' + pattern + '$', re.DOTALL)
+
+
+def parse_pds_ids(
+    test_ids: pd.Series, conditions: list = (), reps_in_title: bool = True
+    ) -> pd.DataFrame:
+    '''
+    Split a column of PDS Test ID's into 'Condition', 'Specimen' and
+    'Replicate' columns. Missing parts are empty strings. Pass no conditions
+    if the study has none.
+    '''
+    ids = test_ids.astype(str)
+    parsed = ids.str.extract(pds_pattern(tuple(conditions), reps_in_title))
+
+    # IDs too short to hold a replicate.
+    short = parsed['Specimen'].isna()
+    parsed.loc[short, 'Specimen'] = ''
+    parsed.loc[short, 'Replicate'] = ids[short]
+
+    return parsed.fillna('')
+
+
+def condition_candidates(test_ids: pd.Series) -> pd.Series:
+    '''
+    First word of every Test ID, NA for IDs without one.
+    '''
+    return test_ids.astype(str).str.extract(CONDITION_PATTERN)['Condition']
+
+
+def parse_qc_ids(test_ids: pd.Series) -> pd.DataFrame:
+    '''
+    Split a column of QC Test ID's into 'Sublot' and 'Sample' columns.
+    Raises ValueError listing the IDs that do not follow the naming.
+    '''
+    ids = test_ids.astype(str)
+    parsed = ids.str.extract(QC_PATTERN)
+
+    negative = ids.str.startswith('N')
+    parsed.loc[negative, 'Sample'] = parsed.loc[negative, 'Negative']
+    parsed.loc[negative, 'Sublot'] = NEGATIVE_SUBLOT
+    parsed = parsed[['Sublot', 'Sample']]
+
+    invalid = parsed.isna().any(axis=1)
+    if invalid.any():
+        raise ValueError(
+            'Could not find the sublot and sample in the following Test IDs: '
+            '{}'.format(', '.join(ids[invalid]))
+            )
+
+    return parsed
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import pds
+
+
+PANEL = ['9172-{:02d}'.format(i) for i in range(1, 13)]
+CONDITIONS = ['4C', '25C', '37C']
+
+
+@pytest.fixture
+def config(tmp_path):
+    return pds.PdsConfig(
+        study_name='stab', panel=PANEL, rep_qty=3, conditions=CONDITIONS,
+        rep_stats=('Mean', 'SD', '%CV', 'Median', 'MAD'),
+        filepath=os.path.join(str(tmp_path), '')
+        )
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    # other studies' tests and rejected strips, which leave specimens incomplete.
+    path = str(tmp_path / 'data.csv')
+    benchmark.synthetic_export(
+        path, PANEL, 3, CONDITIONS, other_rows=40, invalid_rate=0.03, seed=2
+        )
+    return path
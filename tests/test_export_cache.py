@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import export_cache
+import ingest
+
+
+def test_cached_export_matches_parse(tmp_path, export_path):
+    cache = export_cache.ExportCache(str(tmp_path / 'cache'))
+    parsed = export_cache.read_export(export_path, cache)
+    cached = export_cache.read_export(export_path, cache)
+
+    expected = ingest.read_export(export_path)
+    pd.testing.assert_frame_equal(parsed, expected)
+    pd.testing.assert_frame_equal(cached, expected)
+    assert cached['Decision Message 1'].isna().any()
+
+
+def test_cached_floats_are_views_of_the_mapping(tmp_path, export_path):
+    cache = export_cache.ExportCache(str(tmp_path / 'cache'))
+    export_cache.read_export(export_path, cache)
+    cached = export_cache.read_export(export_path, cache)
+
+    for column in ['Decision Message 1', 'Position.1']:
+        values = cached[column].to_numpy()
+        assert not values.flags.owndata and not values.flags.writeable
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    cache = export_cache.ExportCache(str(tmp_path))
+
+    def fail(*args, **kwargs):
+        raise pa.ArrowInvalid('write failed')
+
+    monkeypatch.setattr(pa.ipc, 'new_file', fail)
+    cache.put('digest', pd.DataFrame({'a': [1.0]}))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = export_cache.ExportCache(str(tmp_path))
+    df = pd.DataFrame({'a': np.arange(100.0)})
+    cache.put('old', df)
+    os.utime(cache.entry('old'), (0, 0))
+    cache.max_bytes = os.path.getsize(cache.entry('old'))
+    cache.put('new', df)
+
+    assert cache.get('old') is None
+    pd.testing.assert_frame_equal(cache.get('new'), df)
@@ -0,0 +1,29 @@
+import ingest
+import incremental
+import pds
+import writers
+
+
+def test_incremental_update_matches_full_run(tmp_path, export_path, config):
+    with open(export_path, 'rb') as f:
+        header, *lines = f.readlines()
+
+    # split in the middle of a specimen, so its replicates span both updates.
+    split = len(lines) // 2 + 1
+    source = str(tmp_path / 'growing.csv')
+    with open(source, 'wb') as f:
+        f.writelines([header] + lines[:split])
+    first = incremental.update_study(source, config)
+    with open(source, 'ab') as f:
+        f.writelines(lines[split:])
+    second = incremental.update_study(source, config)
+
+    assert first.rebuilt and not second.rebuilt
+    assert len(first.new_tests) + len(second.new_tests) == len(lines)
+
+    full = pds.process(ingest.read_export(export_path), config)
+    expected = str(tmp_path / 'full.csv')
+    writers.write_rows(expected, full.headers, full.rows)
+    with open(config.csv_path) as updated, open(expected) as f:
+        assert updated.read() == f.read()
+    assert [w.message for w in second.warnings] == [w.message for w in full.warnings]
@@ -0,0 +1,25 @@
+import os
+
+import jobs
+
+
+def crash(progress, run_metrics):
+    # stands in for the OS killing a worker.
+    os._exit(1)
+
+
+def build(progress, run_metrics):
+    with run_metrics.stage('build'):
+        progress.update('Building', 1, 1)
+    return b'docx', []
+
+
+def test_submit_restarts_a_broken_pool():
+    crashed = jobs.submit('crash.docx', crash)
+    assert crashed.future.exception(timeout=60) is not None
+
+    job = jobs.submit('doc.docx', build)
+    data, warnings, stages = job.future.result(timeout=60)
+    assert data == b'docx' and warnings == []
+    assert [s['stage'] for s in stages] == ['build']
+    assert jobs.progress(job) == ('Building', 1, 1)
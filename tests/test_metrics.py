@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pytest
+
+import metrics
+
+
+needs_proc = pytest.mark.skipif(metrics.memory() is None, reason='no /proc/self/status')
+
+
+@needs_proc
+def test_stages_record_their_own_peak():
+    run_metrics = metrics.RunMetrics()
+    with run_metrics.stage('large'):
+        values = np.ones(2 ** 24)
+        values += 1
+        del values
+    with run_metrics.stage('small'):
+        pass
+
+    large, small = run_metrics.stages
+    assert large.peak_mb > 100
+    assert small.peak_mb < 50
+
+
+@needs_proc
+def test_an_inner_stage_keeps_the_outer_peak():
+    run_metrics = metrics.RunMetrics()
+    with run_metrics.stage('outer'):
+        values = np.ones(2 ** 24)
+        values += 1
+        del values
+        with run_metrics.stage('inner'):
+            pass
+
+    inner, outer = run_metrics.stages
+    assert outer.peak_mb > 100
+    assert inner.peak_mb < 50
+
+
+def test_add_stages_extends_its_own_run_report(tmp_path):
+    path = str(tmp_path / 'report.json')
+    run_metrics = metrics.RunMetrics()
+    with run_metrics.stage('format_data'):
+        pass
+    run_metrics.write_report(path, study='stab')
+    started = run_metrics.started.isoformat(timespec='seconds')
+    job = [{'stage': 'tmf901b images', 'seconds': 2.0, 'unit': 'images'}]
+
+    metrics.add_stages(path, job, started)
+    metrics.add_stages(path, job, 'another run')
+
+    with open(path) as f:
+        report = json.load(f)
+    assert [s['stage'] for s in report['stages']] == ['format_data', 'tmf901b images']
+    assert report['seconds'] == pytest.approx(2.0, abs=0.1)
@@ -0,0 +1,16 @@
+import pandas as pd
+
+import ingest
+import pds
+
+
+def test_parallel_replicate_table_matches_serial(export_path, config):
+    data = pds.relevant_data(ingest.read_export(export_path), config)
+
+    serial = pds.replicate_table(data, config)
+    parallel = pds.replicate_table(data, config, workers=2, min_rows=0)
+
+    pd.testing.assert_frame_equal(parallel[0], serial[0])
+    assert parallel[1] == serial[1]
+    assert len(serial[1]) > 0
+
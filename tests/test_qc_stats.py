@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import qc_stats
+
+
+def normal_conditions(rep_qty, conditions=200, specimens=50, seed=0):
+    # specimens with their own means and a shared spread, like a panel.
+    rng = np.random.default_rng(seed)
+    for _ in range(conditions):
+        means = rng.uniform(0.5, 5, size=(specimens, 1))
+        yield means + rng.normal(scale=0.2, size=(specimens, rep_qty))
+
+
+@pytest.mark.parametrize('rep_qty', [3, 4, 5, 6, 9])
+def test_outlier_rate_on_normal_data_is_near_nominal(rep_qty):
+    flagged = total = 0
+    for values in normal_conditions(rep_qty):
+        flagged += (qc_stats.outlier_labels(values) != '').sum()
+        total += len(values)
+
+    assert flagged / total < 1.5 * qc_stats.OUTLIER_ALPHA
+
+
+def test_outlier_labels_flag_a_shifted_replicate():
+    values = next(normal_conditions(3, conditions=1))
+    values[7, 1] += 3
+
+    labels = qc_stats.outlier_labels(values)
+    assert labels[7] == '#2'
+    assert (labels != '').sum() == 1
+
+
+def test_small_conditions_are_not_screened():
+    values = np.array([[1.0, 1.0, 9.0], [2.0, 2.1, 2.0]])
+    assert (qc_stats.outlier_labels(values) == '').all()
+
+
+def test_add_qc_stats_pools_by_condition():
+    values = list(normal_conditions(3, conditions=2, specimens=10))
+    values[1][4, 0] += 5
+    table = pd.DataFrame(np.vstack(values), columns=['VER rep 1', 'VER rep 2', 'VER rep 3'])
+    table.insert(0, 'Condition', ['4C'] * 10 + ['37C'] * 10)
+
+    table = qc_stats.add_qc_stats(table, 3, ['VER'], list(qc_stats.QC_STAT_KEYS))
+
+    assert table.loc[14, 'VER Outliers'] == '#1'
+    assert (table['VER Outliers'] != '').sum() == 1
+    assert table.loc[:9, 'VER Shapiro p'].nunique() == 1
+    assert table.loc[0, 'VER Shapiro p'] == qc_stats.shapiro_p(values[0])
@@ -0,0 +1,62 @@
+import pandas as pd
+
+import pds
+import qcmain
+
+
+def qc_test(test_id, num, time='09:00:00'):
+    sublot, sample = test_id.split(' ', 1)
+    sample = ' '.join(sample.split()[:2])
+    return qcmain.QcClass(
+        test_id, sublot, sample, num, 'QC', 500, 1.0, 1.0, 1.0, time,
+        '2021-11-04'
+        )
+
+
+def test_the_highest_numbered_retest_wins():
+    original = qc_test('sublot_A.B Sample 1', 1)
+    later = qc_test('sublot_A.B Sample 1 retest', 9)
+    earlier = qc_test('sublot_A.B Sample 1 retest', 5)
+    other = qc_test('sublot_A.B Sample 2', 2)
+
+    tests, superseded, unmatched = qcmain.resolve_retests([original, later, other, earlier])
+    assert tests == [later, other]
+    assert superseded == [(original, later)]
+    assert unmatched == []
+
+
+def test_tied_retests_go_to_the_later_row():
+    original = qc_test('sublot_A.B Sample 1', 1)
+    first = qc_test('sublot_A.B Sample 1 retest', 4)
+    second = qc_test('sublot_A.B Sample 1 retest', 4)
+
+    tests, _, _ = qcmain.resolve_retests([original, first, second])
+    assert tests[0] is second
+
+
+def test_retests_without_a_number_rank_by_time():
+    original = qc_test('sublot_A.B Sample 1', 1)
+    numbered = qc_test('sublot_A.B Sample 1 retest', 3, '09:05:00')
+    late = qc_test('sublot_A.B Sample 1 retest', pd.NA, '10:00:00')
+    early = qc_test('sublot_A.B Sample 1 retest', pd.NA, '09:30:00')
+
+    tests, _, _ = qcmain.resolve_retests([original, late, early])
+    assert tests == [late]
+    # a numbered retest ranks above any retest without a number.
+    tests, _, _ = qcmain.resolve_retests([original, late, numbered])
+    assert tests == [numbered]
+
+
+def test_unmatched_retests_are_left_out_and_reported():
+    original = qc_test('sublot_A.B Sample 1', 1)
+    stray = qc_test('sublot_C.D Sample 3 retest', 2)
+
+    tests, superseded, unmatched = qcmain.resolve_retests([original, stray])
+    assert tests == [original]
+    assert superseded == []
+    assert unmatched == [stray]
+
+    warnings = qcmain.retest_warnings(superseded, unmatched)
+    assert [(w.kind, w.items) for w in warnings] == [
+        (pds.UNMATCHED_RETESTS, ('sublot_C.D Sample 3 retest',))
+        ]
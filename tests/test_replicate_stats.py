@@ -0,0 +1,89 @@
+import statistics
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import CONDITIONS, PANEL
+import ingest
+import pds
+import replicate_stats
+
+
+def reference_stats(values):
+    # the stats of one specimen, as the per specimen TestClass computed them.
+    values = [round(float(v), 3) for v in values]
+    mean = round(statistics.mean(values), 3)
+    median = round(statistics.median(values), 3)
+    sd = round(statistics.stdev(values), 3)
+    return {
+        'Mean': mean, 'Median': median, 'SD': sd,
+        '%CV': round(sd / mean * 100, 1),
+        'MAD': round(statistics.median([abs(v - median) for v in values]), 3)
+        }
+
+
+def filtered_ids(test_ids, panel, condition_list, multiple_conditions, reps_in_title):
+    # the original remove_irrelevant_testing loops, on a list of Test ID's.
+    kept = []
+    if multiple_conditions:
+        for condition in condition_list:
+            c = len(condition) + 1
+            for i, test in enumerate(test_ids):
+                if reps_in_title:
+                    if test[c:-2] in panel and condition == test[:c - 1]:
+                        kept.append(i)
+                elif test[c:] in panel and condition in test:
+                    kept.append(i)
+    else:
+        for i, test in enumerate(test_ids):
+            if (test[:-2] if reps_in_title else test) in panel:
+                kept.append(i)
+    return sorted(kept)
+
+
+def test_stats_match_per_specimen_reference(export_path, config):
+    data = pds.relevant_data(ingest.read_export(export_path), config)
+    table, incomplete = replicate_stats.compute_replicate_stats(
+        data, config.rep_qty, config.conditions, True, True
+        )
+    assert len(incomplete) > 0
+    assert len(table) + len(incomplete) == len(PANEL) * len(CONDITIONS)
+
+    groups = data.groupby(['Condition', 'Specimen'])
+    for _, row in table.iterrows():
+        rows = groups.get_group((row['Condition'], row['Specimen']))
+        for line, column in replicate_stats.LINE_COLUMNS.items():
+            for stat, value in reference_stats(rows[column]).items():
+                assert row['{} {}'.format(line, stat)] == pytest.approx(value, abs=1e-9)
+
+
+def test_specimens_are_ordered_by_condition(export_path, config):
+    data = pds.relevant_data(ingest.read_export(export_path), config)
+    table, _ = replicate_stats.compute_replicate_stats(
+        data.sample(frac=1, random_state=0), config.rep_qty,
+        ['37C', '4C', '25C'], True, True
+        )
+    ranks = table['Condition'].map({'37C': 0, '4C': 1, '25C': 2})
+    assert ranks.is_monotonic_increasing
+
+
+@pytest.mark.parametrize('multiple_conditions', [True, False])
+@pytest.mark.parametrize('reps_in_title', [True, False])
+def test_relevant_mask_matches_original_filter(multiple_conditions, reps_in_title):
+    panel = PANEL[:4]
+    ids = []
+    for condition in CONDITIONS + ['RT', '']:
+        for specimen in PANEL[:6] + ['other 00001']:
+            for rep in '123':
+                test_id = specimen + ('-' + rep if reps_in_title else '')
+                ids.append(condition + ' ' + test_id if condition else test_id)
+    data = pd.DataFrame({'Test ID': ids})
+    condition_list = CONDITIONS if multiple_conditions else []
+
+    mask = replicate_stats.relevant_mask(
+        data, panel, condition_list, multiple_conditions, reps_in_title
+        )
+    expected = filtered_ids(ids, panel, condition_list, multiple_conditions, reps_in_title)
+    assert list(np.flatnonzero(mask)) == expected
+    assert len(expected) > 0
@@ -0,0 +1,74 @@
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+
+import ingest
+import pds
+import shifts
+import writers
+
+
+def position_table(ver, ltr):
+    # a replicate stats table holding only the positions, one row per specimen.
+    ver, ltr = np.asarray(ver, dtype=float), np.asarray(ltr, dtype=float)
+    table = {
+        'Condition': ['4C'] * len(ver),
+        'Specimen': ['9172-{:02d}'.format(i + 1) for i in range(len(ver))]
+        }
+    for line, positions in [('VER', ver), ('LTR', ltr)]:
+        for j in range(positions.shape[1]):
+            table['{} position {}'.format(line, j + 1)] = positions[:, j]
+    return pd.DataFrame(table)
+
+
+def test_positions_over_the_limit_are_flagged():
+    table = position_table([[320, 320, 320]] * 2, [[500, 500, 500], [500, 540, 500]])
+
+    flags = shifts.detect_shifts(table, 3, shifts.ShiftLimits())
+    assert flags[['Specimen', 'Line', 'Strip', 'Reason', 'Bound']].values.tolist() == [
+        ['9172-02', 'LTR', 2, 'limit', 530.0]
+        ]
+
+
+def test_outliers_against_the_baseline_are_flagged_with_k():
+    ltr = [[500, 501, 499]] * 8 + [[503, 500, 515]]
+    table = position_table([[320, 320, 320]] * 9, ltr)
+
+    assert len(shifts.detect_shifts(table, 3, shifts.ShiftLimits())) == 0
+
+    # the MAD of the run is 0, min_mad keeps 503 inside the baseline.
+    flags = shifts.detect_shifts(table, 3, shifts.ShiftLimits(k=3))
+    assert flags[['Specimen', 'Strip', 'Position', 'Reason', 'Bound']].values.tolist() == [
+        ['9172-09', 3, 515.0, 'baseline', 506.0]
+        ]
+
+
+def test_oral_fluid_has_no_ltr_flags():
+    table = position_table([[320, 340, 320]], [[600, 600, 600]])
+
+    flags = shifts.detect_shifts(table, 3, shifts.ASSAY_LIMITS['Oral Fluid'])
+    assert flags['Line'].tolist() == ['VER']
+
+
+def test_flags_are_written_with_the_shifts_stat(export_path, config):
+    config = replace(config, rep_stats=('Mean', 'Shifts'))
+    data = pds.relevant_data(ingest.read_export(export_path), config)
+    shifted = data.index[4]
+    data.loc[shifted, 'Position.2'] = 600
+    table, incomplete = pds.replicate_table(data, config)
+
+    result = pds.format_data(table, incomplete, config)
+    stats_table = result.stats_table.set_index(['Condition', 'Specimen'])
+    key = tuple(data.loc[shifted, ['Condition', 'Specimen']])
+    assert '#{}'.format(data.loc[shifted, 'Replicate']) in stats_table.loc[key, 'LTR Shifts']
+    assert (stats_table['CTRL Shifts'] == '').all()
+
+    # one cell per flagged line of a specimen, in the csv rows and the tables.
+    flagged_lines = len(result.shifts.groupby(['Condition', 'Specimen', 'Line']))
+    cells = [cell for row in result.rows for cell in row if str(cell).startswith('#')]
+    assert len(cells) == flagged_lines
+
+    frame = writers.prism_table(result.stats_table, config)
+    assert list(frame.columns).count('Shifts') == 3
+    assert frame['Shifts'].apply(lambda c: c.str.startswith('#')).sum(axis=None) == flagged_lines
@@ -0,0 +1,38 @@
+from dataclasses import replace
+
+import pandas as pd
+import pytest
+
+import ingest
+import pds
+import streaming
+import writers
+
+
+def assert_streams_like_process(source, config, tmp_path):
+    result = pds.process(ingest.read_export(source), config)
+    expected = str(tmp_path / 'expected.csv')
+    writers.write_rows(expected, result.headers, result.rows)
+
+    for chunksize in (5, 17, 1000):
+        streamed = str(tmp_path / 'streamed.csv')
+        warnings = streaming.stream_format_data(source, streamed, config, chunksize)
+        with open(streamed) as s, open(expected) as f:
+            assert s.read() == f.read()
+        assert [w.message for w in warnings] == [w.message for w in result.warnings]
+
+
+@pytest.mark.parametrize('order', ['export', 'shuffled', 'late extra'])
+def test_streaming_matches_process(tmp_path, export_path, config, order):
+    with open(export_path) as f:
+        header = f.readline().rstrip('\n').split(',')
+    export = pd.read_csv(export_path, dtype=str, keep_default_na=False)
+    if order == 'shuffled':
+        export = export.sample(frac=1, random_state=3)
+    elif order == 'late extra':
+        export = pd.concat([export, export.iloc[[0]]])
+    source = str(tmp_path / 'export.csv')
+    export.to_csv(source, index=False, header=header)
+
+    config = replace(config, rep_stats=('Mean', 'SD', 'Shapiro p', 'Outliers', 'Shifts'))
+    assert_streams_like_process(source, config, tmp_path)
@@ -0,0 +1,66 @@
+import pandas as pd
+from PIL import Image
+
+import strip_images
+
+
+def times(*values):
+    return pd.Series(pd.to_datetime(list(values)))
+
+
+def test_images_are_matched_to_the_nearest_test():
+    index = {
+        pd.Timestamp('2021-11-04 09:00:00'): 'a', pd.Timestamp('2021-11-04 09:01:01'): 'b',
+        pd.Timestamp('2021-11-04 09:05:00'): 'c'
+        }
+    acquired = times(
+        '2021-11-04 09:00:00', '2021-11-04 09:01:00', '2021-11-04 09:03:00', None
+        )
+
+    match = strip_images.match_strip_images(acquired, index)
+    assert match['Path'].tolist() == ['a', 'b', None, None]
+    assert match['Match'].tolist() == [
+        strip_images.FOUND, strip_images.FOUND, strip_images.MISSING,
+        strip_images.MISSING
+        ]
+
+
+def test_an_exact_match_takes_the_image():
+    index = {pd.Timestamp('2021-11-04 09:00:00'): 'a'}
+    acquired = times('2021-11-04 09:00:01', '2021-11-04 09:00:00')
+
+    match = strip_images.match_strip_images(acquired, index)
+    assert match['Path'].tolist() == [None, 'a']
+    assert match['Match'].tolist() == [strip_images.MISSING, strip_images.FOUND]
+
+
+def test_an_image_near_several_tests_is_ambiguous():
+    index = {pd.Timestamp('2021-11-04 09:00:00'): 'a'}
+    acquired = times('2021-11-04 08:59:59', '2021-11-04 09:00:01')
+
+    match = strip_images.match_strip_images(acquired, index)
+    assert match['Path'].isna().all()
+    assert (match['Match'] == strip_images.AMBIGUOUS).all()
+
+
+def test_folder_names_are_indexed_by_time(tmp_path):
+    (tmp_path / strip_images.folder_name('2021-11-04', '09:01:01')).mkdir()
+    (tmp_path / 'notes').mkdir()
+
+    index = strip_images.index_strip_images(str(tmp_path))
+    assert list(index) == [pd.Timestamp('2021-11-04 09:01:01')]
+    assert strip_images.index_strip_images(str(tmp_path / 'missing')) == {}
+
+
+def test_thumbnails_are_not_served_after_a_render_change(tmp_path, monkeypatch):
+    folder = tmp_path / strip_images.folder_name('2021-11-04', '09:01:01')
+    folder.mkdir()
+    image = str(folder / strip_images.IMAGE_NAME)
+    Image.new('RGB', (1000, 200), 'white').save(image)
+
+    cache = strip_images.ThumbnailCache(str(tmp_path / 'cache'))
+    strip_images.load_strip_image(image, cache)
+    assert cache.get(image) is not None
+
+    monkeypatch.setattr(strip_images, 'STRIP_DPI', 300)
+    assert strip_images.ThumbnailCache(str(tmp_path / 'cache')).get(image) is None
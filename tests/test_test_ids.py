@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import test_ids
+
+
+def sliced_id(test_id, condition, reps_in_title):
+    # how the Test ID's were split before parse_pds_ids, by slicing off the
+    # condition and the replicate.
+    c = len(condition) + 1 if condition else 0
+    specimen = test_id[c:-2] if reps_in_title else test_id[c:]
+    replicate = test_id[-1] if reps_in_title else ''
+    return condition, specimen, replicate
+
+
+@pytest.mark.parametrize('conditions', [['4C', '25C', 'RT'], []])
+@pytest.mark.parametrize('reps_in_title', [True, False])
+def test_parse_pds_ids_matches_slicing(conditions, reps_in_title):
+    specimens = ['9172-01', 'Boca124', 'A 7', '1']
+    expected = []
+    ids = []
+    for condition in conditions or ['']:
+        for specimen in specimens:
+            for rep in '123':
+                test_id = specimen + ('-' + rep if reps_in_title else '')
+                if condition:
+                    test_id = condition + ' ' + test_id
+                ids.append(test_id)
+                expected.append(sliced_id(test_id, condition, reps_in_title))
+
+    parsed = test_ids.parse_pds_ids(pd.Series(ids), conditions, reps_in_title)
+    assert list(parsed.itertuples(index=False, name=None)) == expected
+
+
+def test_parse_pds_ids_prefers_the_longest_condition():
+    parsed = test_ids.parse_pds_ids(pd.Series(['4C wk2 9172-01-1']), ['4C', '4C wk2'])
+    assert parsed.iloc[0].tolist() == ['4C wk2', '9172-01', '1']
+
+
+
+def test_pds_pattern_orders_conditions_deterministically():
+    conditions = ('RT', '4C wk1', '4C', '25C wk1', '4C wk10')
+    pattern = test_ids.pds_pattern(conditions, True).pattern
+    assert r'(?P<Condition>25C\ wk1|4C\ wk10|4C\ wk1|4C|RT)' in pattern
+
+
+def test_parse_pds_ids_leaves_unknown_conditions_in_the_specimen():
+    parsed = test_ids.parse_pds_ids(pd.Series(['RT 9172-01-1']), ['4C'])
+    assert parsed.iloc[0].tolist() == ['', 'RT 9172-01', '1']
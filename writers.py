@@ -0,0 +1,130 @@
+'''
+Writers for the formatted data table that is pasted into GraphPad Prism.
+CSV and tab separated text are written from the formatted rows with one
+buffered csv writer. XLSX and Parquet are written from the same table built
+column by column from the replicate stats table by prism_table. Every writer
+takes a file path or a binary file object, so downloads can be served from
+an in-memory buffer.
+
+XLSX needs openpyxl and Parquet needs pyarrow.
+'''
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+import pds
+import replicate_stats
+
+
+FORMATS = ['tsv', 'csv', 'xlsx', 'parquet']
+
+EXTENSIONS = {'csv': '.csv', 'tsv': '.txt', 'xlsx': '.xlsx', 'parquet': '.parquet'}
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet'
+    }
+
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def prism_table(stats_table: pd.DataFrame, config: pds.PdsConfig) -> pd.DataFrame:
+    '''
+    The formatted data table as a DataFrame: a CTRL, VER and LTR block of
+    specimen, lot and selected stat columns, one row per specimen and a
+    blank row after each condition. Column names are the formatted headers,
+    so names repeat between blocks.
+    '''
+    columns = replicate_stats.row_columns(
+        config.rep_qty, config.lines, config.rep_stats,
+        config.multiple_conditions
+        )
+    headers = replicate_stats.format_headers(
+        config.lines, config.lots, config.rep_stats, config.multiple_conditions
+        )[:len(columns)]
+
+    # row n is the blank row.
+    n = len(stats_table)
+    if config.multiple_conditions:
+        conditions = stats_table['Condition'].to_numpy()
+        order = []
+        for condition in config.conditions:
+            order.extend(np.flatnonzero(conditions == condition))
+            order.append(n)
+    else:
+        order = list(range(n)) + [n]
+    order = np.array(order, dtype=int)
+
+    cells = {}
+    for i, column in enumerate(columns):
+        if column is None:
+            values = np.full(n + 1, ' ', dtype=object)
+        else:
+            values = np.append(stats_table[column].to_numpy(dtype=object), None)
+        values[n] = ' ' if i == 0 else None
+        cells[i] = values[order]
+
+    frame = pd.DataFrame(cells)
+    frame.columns = headers
+    return frame
+
+
+def to_buffer(write, *args) -> io.BytesIO:
+    '''
+    Run a writer into an in-memory buffer, rewound for reading.
+    '''
+    buffer = io.BytesIO()
+    write(buffer, *args)
+    buffer.seek(0)
+    return buffer
+
+
+def write_rows(target, headers: list, rows: list, fmt: str = 'csv'):
+    '''
+    Write the formatted rows as csv or tab separated text to a file path or
+    binary file object.
+    '''
+    if isinstance(target, str):
+        with open(target, 'wb', buffering=BUFFER_SIZE) as f:
+            write_rows(f, headers, rows, fmt)
+        return
+
+    text = io.TextIOWrapper(target, newline='', write_through=False)
+    csvwriter = csv.writer(text, delimiter=DELIMITERS[fmt])
+    csvwriter.writerow(headers)
+    csvwriter.writerows(rows)
+    # leave the target open for the caller.
+    text.flush()
+    text.detach()
+
+
+def write_table(target, frame: pd.DataFrame, fmt: str):
+    '''
+    Write a prism_table to a file path or binary file object as xlsx or
+    parquet. Parquet needs unique column names, so its columns are named
+    after their line block and the spacer columns are left out.
+    '''
+    if fmt == 'xlsx':
+        frame.to_excel(target, index=False)
+    elif fmt == 'parquet':
+        names = []
+        block = ''
+        for name in frame.columns:
+            if ' | ' in name:
+                block = name.split(' | ')[0]
+                names.append(name)
+            elif name in ('Condition', ' '):
+                names.append(name)
+            else:
+                names.append('{} {}'.format(block, name))
+        frame = frame.set_axis(names, axis=1)
+        keep = ~frame.columns.duplicated() & (frame.columns != ' ')
+        frame.loc[:, keep].to_parquet(target, index=False)
+    else:
+        raise ValueError('Unknown table format: {}'.format(fmt))